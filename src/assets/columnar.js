@@ -0,0 +1,28 @@
+// Expand tables sent by src/serialization.py:to_columnar back into the list of
+// row objects a DataTable expects
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    columnar: {
+        to_records: function(table) {
+            if (!table) {
+                return window.dash_clientside.no_update;
+            }
+            const columns = table.columns.map(name => {
+                const values = table.values[name];
+                if (Array.isArray(values)) {
+                    return values;
+                }
+                // Dictionary encoded: each row holds an index into the categories
+                return values.codes.map(code => code < 0 ? null : values.categories[code]);
+            });
+            const records = new Array(table.length);
+            for (let i = 0; i < table.length; i++) {
+                const row = {};
+                for (let c = 0; c < columns.length; c++) {
+                    row[table.columns[c]] = columns[c][i];
+                }
+                records[i] = row;
+            }
+            return records;
+        }
+    }
+});
@@ -0,0 +1,90 @@
+// Resumable chunked uploads for the Upload page, written to disk by the
+// /upload route in src/ingest.py. An interrupted upload continues from the
+// bytes the server already has when the same file is selected again.
+(function() {
+    const CHUNK_BYTES = 8 * 1024 * 1024;
+    const RETRIES = 5;
+
+    function uploadId(file) {
+        const name = file.name.replace(/[^A-Za-z0-9_.-]/g, '_').slice(0, 80);
+        return `${file.size}-${file.lastModified}-${name}`;
+    }
+
+    function uploadUrl(id) {
+        const config = JSON.parse(document.getElementById('_dash-config').textContent);
+        return `${config.requests_pathname_prefix}upload/${encodeURIComponent(id)}`;
+    }
+
+    function setProps(id, props) {
+        window.dash_clientside.set_props(id, props);
+    }
+
+    async function received(url) {
+        const response = await fetch(url);
+        if (!response.ok) {
+            throw new Error(`Upload failed: HTTP ${response.status}`);
+        }
+        return (await response.json()).received;
+    }
+
+    async function upload(file) {
+        const id = uploadId(file);
+        const url = uploadUrl(id);
+        let offset = await received(url);
+        const resumedAt = offset;
+        const started = performance.now();
+        let failures = 0;
+
+        while (offset < file.size) {
+            try {
+                const response = await fetch(`${url}?offset=${offset}`, {
+                    method: 'PUT',
+                    body: file.slice(offset, offset + CHUNK_BYTES)
+                });
+                // 409: the server has a different offset, continue from there
+                if (!response.ok && response.status !== 409) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                offset = (await response.json()).received;
+                failures = 0;
+            } catch (error) {
+                if (++failures > RETRIES) {
+                    throw new Error(`Upload failed: ${error.message}. Select the file again to resume.`);
+                }
+                await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+                offset = await received(url);
+            }
+
+            const seconds = (performance.now() - started) / 1000;
+            const rate = (offset - resumedAt) / 1048576 / Math.max(seconds, 0.001);
+            setProps('upload-progress', {value: String(offset), max: String(file.size)});
+            setProps('upload-status', {
+                children: `${(offset / 1048576).toFixed(1)} of ${(file.size / 1048576).toFixed(1)} MiB uploaded (${rate.toFixed(1)} MiB/s)`
+            });
+        }
+        setProps('upload-complete', {data: {upload_id: id, filename: file.name, size: file.size}});
+    }
+
+    // Dash has no file input component, so one is added to the page's placeholder
+    // whenever the Upload page is rendered
+    function addFileInput() {
+        const container = document.getElementById('upload-file-container');
+        if (!container || document.getElementById('upload-file')) {
+            return;
+        }
+        const input = document.createElement('input');
+        input.id = 'upload-file';
+        input.type = 'file';
+        input.accept = '.csv,.geojson,.json';
+        container.appendChild(input);
+    }
+
+    new MutationObserver(addFileInput).observe(document.documentElement, {childList: true, subtree: true});
+
+    document.addEventListener('change', event => {
+        if (event.target.id !== 'upload-file' || !event.target.files.length) {
+            return;
+        }
+        upload(event.target.files[0]).catch(error => setProps('upload-status', {children: error.message}));
+    });
+})();
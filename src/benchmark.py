@@ -0,0 +1,375 @@
+# Synthetic data generator and benchmarks for the pages and their callbacks
+#
+#   uv run python -m src.benchmark --rows 1000000 --polygons 20000 --vertices 64 --output results.json
+import argparse
+import base64
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import dash
+import numpy as np
+import pandas as pd
+import shapely
+from plotly.io.json import to_json_plotly
+from src import config
+from src.lib import (
+    bump_table_revision, bump_write_counter, clear_data_cache, close_connections, ensure_id_index,
+    column_memory, get_connection, get_storage, get_table_revision, read_sales_cube, read_table_compact,
+    rebuild_geo_index, rebuild_summary_tables, replace_table, transaction
+)
+from src.serialization import brotli, compress
+
+PRODUCTS = [f'Product {chr(ord("A") + i)}' for i in range(10)]
+REGIONS = ['North', 'South', 'East', 'West']
+QUARTERS = ['Q1', 'Q2', 'Q3', 'Q4']
+
+# Synthetic areas are laid out on a grid around the map's initial view
+GEO_ORIGIN = (-74.01, 40.72)
+GEO_CELL_DEGREES = 0.01
+
+
+def generate_sales_data(rows, seed=0):
+    """Build a sales_data frame of the given size with NumPy, no Python loop per row"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'id': np.arange(1, rows + 1),
+        'product': np.array(PRODUCTS)[rng.integers(0, len(PRODUCTS), rows)],
+        'sales': rng.integers(100, 1000, rows),
+        'region': np.array(REGIONS)[rng.integers(0, len(REGIONS), rows)],
+        'quarter': np.array(QUARTERS)[rng.integers(0, len(QUARTERS), rows)],
+    })
+
+
+def generate_geo_polygons(polygons, vertices, seed=0):
+    """Build non-overlapping star-shaped polygons with the given number of vertices each"""
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(polygons)))
+    cells = np.arange(polygons)
+    # One grid cell per polygon, centered on the origin
+    centers = np.column_stack([
+        GEO_ORIGIN[0] + (cells % side - side / 2) * GEO_CELL_DEGREES,
+        GEO_ORIGIN[1] + (cells // side - side / 2) * GEO_CELL_DEGREES,
+    ])
+
+    # Radii stay below half a cell so neighbouring areas never overlap
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radii = GEO_CELL_DEGREES * rng.uniform(0.25, 0.45, (polygons, vertices))
+    coords = np.stack([
+        centers[:, [0]] + radii * np.cos(angles),
+        centers[:, [1]] + radii * np.sin(angles),
+    ], axis=-1)
+    # Close each ring
+    coords = np.concatenate([coords, coords[:, :1]], axis=1)
+    return shapely.polygons(coords)
+
+
+def generate_geo_data(polygons, vertices, seed=0):
+    """Build a geo_data frame (attributes plus WKB geometry) and its geometries"""
+    rng = np.random.default_rng(seed)
+    geometries = generate_geo_polygons(polygons, vertices, seed)
+    # Roughly 111 km per degree at these latitudes
+    area_km2 = shapely.area(geometries) * 111.0 * 111.0 * np.cos(np.radians(GEO_ORIGIN[1]))
+    df = pd.DataFrame({
+        'id': np.arange(1, polygons + 1),
+        'name': np.char.add('Area ', np.arange(1, polygons + 1).astype(str)),
+        'population': rng.integers(1000, 100000, polygons),
+        'area_km2': area_km2.round(2),
+    })
+    df['geometry'] = shapely.to_wkb(geometries)
+    return df, geometries
+
+
+def create_synthetic_database(rows, polygons, vertices, seed=0):
+    """Replace sales_data and geo_data in the configured database with synthetic data
+
+    Returns the time spent on each step, in seconds.
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    sales = generate_sales_data(rows, seed)
+    timings['generate_sales_data'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with transaction() as conn:
+        replace_table(conn, 'sales_data', sales)
+        ensure_id_index(conn, 'sales_data')
+        rebuild_summary_tables(conn)
+        bump_table_revision(conn, 'sales_data')
+    timings['write_sales_data'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    geo, geometries = generate_geo_data(polygons, vertices, seed)
+    timings['generate_geo_data'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with transaction() as conn:
+        replace_table(conn, 'geo_data', geo, dtype={'geometry': 'BLOB'})
+        rebuild_geo_index(conn, geo['id'], geometries)
+        bump_table_revision(conn, 'geo_data')
+    timings['write_geo_data'] = time.perf_counter() - start
+
+    bump_write_counter()
+    print(f"Synthetic database created: {rows:,} sales rows, {polygons:,} polygons of {vertices} vertices")
+    return timings
+
+
+def response_size(result):
+    """Bytes of a callback or layout result once serialized the way Dash sends it, and gzip/brotli compressed"""
+    if isinstance(result, pd.DataFrame):
+        return None, None, None  # Storage reads never leave the server
+    data = to_json_plotly(result).encode()
+    brotli_size = len(compress(data, 'br')) if brotli is not None else None
+    return len(data), len(compress(data, 'gzip')), brotli_size
+
+
+def legacy_encoding(payload):
+    """A JSON payload as it was sent before the compact encodings: tables as records, arrays as plain lists"""
+    if isinstance(payload, list):
+        return [legacy_encoding(value) for value in payload]
+    if not isinstance(payload, dict):
+        return payload
+    if {'dtype', 'bdata'} <= set(payload) <= {'dtype', 'bdata', 'shape'}:
+        # A plotly.js typed array
+        values = np.frombuffer(base64.b64decode(payload['bdata']), dtype=payload['dtype'])
+        if 'shape' in payload:
+            values = values.reshape([int(n) for n in str(payload['shape']).split(',')])
+        return values.tolist()
+    if set(payload) == {'columns', 'length', 'values'}:
+        # A table from serialization.to_columnar, as DataFrame.to_dict('records') sent it
+        columns = {}
+        for col, values in payload['values'].items():
+            if isinstance(values, dict):
+                values = [values['categories'][code] if code >= 0 else None for code in values['codes']]
+            columns[col] = values
+        return [{col: columns[col][i] for col in payload['columns']} for i in range(payload['length'])]
+    return {key: legacy_encoding(value) for key, value in payload.items()}
+
+
+def legacy_response_size(result):
+    """Bytes of a result in the encodings used before typed arrays and columnar tables, and gzip compressed"""
+    if isinstance(result, pd.DataFrame):
+        return None, None
+    # Separators as compact as plotly's, so only the encodings differ
+    data = json.dumps(legacy_encoding(json.loads(to_json_plotly(result))), separators=(',', ':')).encode()
+    return len(data), len(compress(data, 'gzip'))
+
+
+def measure(name, func, repeat=5, setup=None):
+    """Time a call with cold and warm caches, and record its peak memory and response size"""
+    # Cold: nothing cached for the current data version
+    if setup:
+        setup()
+    clear_data_cache()
+    start = time.perf_counter()
+    result = func()
+    cold = time.perf_counter() - start
+    size, gzip_size, brotli_size = response_size(result)
+    # The same response as records and plain lists, to see what the compact encodings save
+    legacy_size, legacy_gzip_size = legacy_response_size(result)
+
+    warm = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        warm.append(time.perf_counter() - start)
+
+    # Memory is traced in a separate cold run, tracing slows the call down
+    if setup:
+        setup()
+    clear_data_cache()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'name': name,
+        'cold_seconds': cold,
+        'warm_median_seconds': statistics.median(warm) if warm else None,
+        'warm_min_seconds': min(warm) if warm else None,
+        'warm_max_seconds': max(warm) if warm else None,
+        'peak_memory_bytes': peak,
+        'response_bytes': size,
+        'response_gzip_bytes': gzip_size,
+        'response_brotli_bytes': brotli_size,
+        'legacy_response_bytes': legacy_size,
+        'legacy_response_gzip_bytes': legacy_gzip_size,
+    }
+    print(
+        f"{name:<36} cold {cold * 1000:9.1f} ms   warm {(result['warm_median_seconds'] or 0) * 1000:9.1f} ms   "
+        f"peak {peak / 2 ** 20:8.1f} MiB   response {(size or 0) / 1024:10.1f} KiB   gzip {(gzip_size or 0) / 1024:9.1f} KiB   "
+        f"legacy {(legacy_size or 0) / 1024:10.1f} KiB   gzip {(legacy_gzip_size or 0) / 1024:9.1f} KiB"
+    )
+    return result
+
+
+def run_benchmarks(repeat=5, edits=100, seed=0):
+    """Benchmark every page layout and the server callbacks against the configured database"""
+    # Use the page modules the app imported; importing them again would register them twice
+    from src.main import create_app
+    app = create_app()
+    pages = {page['module'].rsplit('.', 1)[-1]: sys.modules[page['module']] for page in dash.page_registry.values()}
+    single_dataframe, single_editor, single_map = pages['single_dataframe'], pages['single_editor'], pages['single_map']
+
+    rng = np.random.default_rng(seed)
+    rows = get_connection().execute('SELECT COUNT(*) FROM sales_data').fetchone()[0]
+    polygons = get_connection().execute('SELECT COUNT(*) FROM geo_data').fetchone()[0]
+
+    # Each save edits the sales of a random set of rows
+    changes = {}
+
+    def new_changes():
+        ids = rng.choice(np.arange(1, rows + 1), size=min(edits, rows), replace=False)
+        changes['current'] = {
+            'updated': {str(i): {'sales': int(v)} for i, v in zip(ids, rng.integers(100, 1000, len(ids)))},
+            'deleted': [],
+        }
+
+    def no_progress(value):
+        pass
+
+    # A selection of areas, and a pan to the grid corner so the view holds other areas
+    selected_ids = rng.choice(np.arange(1, polygons + 1), size=min(10, polygons), replace=False).tolist()
+    relayout_data = {
+        'map.center': {'lon': GEO_ORIGIN[0] - GEO_CELL_DEGREES * 5, 'lat': GEO_ORIGIN[1] - GEO_CELL_DEGREES * 5},
+        'map.zoom': single_map.MAP_ZOOM + 1,
+    }
+
+    # The dashboard version the browser holds after loading the current data, and one from before
+    current_version = single_dataframe.dashboard_version(get_table_revision('sales_data'), single_dataframe.dashboard_summary())
+    stale_version = {'revision': -1, 'panels': {}}
+    # A region and quarter clicked in the charts
+    filters = {'region': REGIONS[0], 'quarter': QUARTERS[0]}
+
+    with app.server.test_request_context():
+        return [
+            measure('single_dataframe.layout', single_dataframe.layout, repeat),
+            measure('single_editor.layout', single_editor.layout, repeat),
+            measure('single_map.layout', single_map.layout, repeat),
+            measure('refresh_data', lambda: single_dataframe.refresh_data(1, {}), repeat),
+            # Each panel is a callback of its own, requested in parallel by the browser
+            *(
+                measure(f'panel.{name}', lambda update_panel=update_panel: update_panel(1, {}), repeat)
+                for name, update_panel in single_dataframe.PANEL_CALLBACKS.items()
+            ),
+            # A live update tick with nothing new, and one that redraws every panel
+            measure('live_update.unchanged', lambda: single_dataframe.live_update(1, current_version, {}), repeat),
+            measure('live_update.changed', lambda: single_dataframe.live_update(1, stale_version, {}), repeat),
+            # Cross-filtering slices the cube, which is read again after each write (the cold time)
+            measure('read_sales_cube', read_sales_cube, repeat),
+            measure('cross_filter', lambda: single_dataframe.cross_filter(filters, current_version), repeat),
+            measure('update_table_page', lambda: single_dataframe.update_table_page(0, single_dataframe.PAGE_SIZE, [], ''), repeat),
+            measure('save_changes', lambda: single_editor.save_changes(no_progress, 1, changes['current']), repeat, setup=new_changes),
+            # Map and table selections sync in the browser; these are the server calls left on that path
+            measure('load_selected_geometry', lambda: single_map.load_selected_geometry(selected_ids), repeat),
+            measure('update_map_viewport', lambda: single_map.update_map_viewport(relayout_data), repeat),
+        ]
+
+
+def run_storage_benchmarks(repeat=5, seed=0):
+    """Benchmark the same reads on every storage backend that can be loaded"""
+    rng = np.random.default_rng(seed)
+    polygons = get_connection().execute('SELECT COUNT(*) FROM geo_data').fetchone()[0]
+    ids = rng.choice(np.arange(1, polygons + 1), size=min(10, polygons), replace=False).tolist()
+    bounds = (
+        GEO_ORIGIN[0] - GEO_CELL_DEGREES * 10, GEO_ORIGIN[1] - GEO_CELL_DEGREES * 10,
+        GEO_ORIGIN[0] + GEO_CELL_DEGREES * 10, GEO_ORIGIN[1] + GEO_CELL_DEGREES * 10,
+    )
+
+    results = []
+    for backend in ['sqlite', 'parquet']:
+        try:
+            storage = get_storage(backend)
+        except ImportError as e:
+            print(f"Skipping the {backend} storage backend: {e}")
+            continue
+        if backend == 'parquet':
+            # Exporting the snapshots happens once per table revision
+            results.append(measure('storage.parquet.snapshot', lambda: [
+                storage.snapshot_path('sales_data'), storage.snapshot_path('geo_data')
+            ], repeat=0))
+        results += [
+            measure(f'storage.{backend}.sales_data', lambda: storage.read('sales_data'), repeat),
+            measure(f'storage.{backend}.sales_data_compact', lambda: read_table_compact('sales_data', backend=backend), repeat),
+            measure(f'storage.{backend}.sales_data_columns', lambda: storage.read('sales_data', columns=['region', 'sales']), repeat),
+            measure(f'storage.{backend}.sales_data_filter', lambda: storage.read('sales_data', filters=[('region', '=', 'North')]), repeat),
+            measure(f'storage.{backend}.geo_data', lambda: storage.read('geo_data'), repeat),
+            measure(f'storage.{backend}.geo_data_ids', lambda: storage.read('geo_data', filters=[('id', 'in', ids)]), repeat),
+            measure(f'storage.{backend}.geo_data_bbox', lambda: storage.read_in_bbox('geo_data', *bounds, limit=config.MAP_MAX_FEATURES), repeat),
+        ]
+    return results
+
+
+def report_column_memory(table_name='sales_data'):
+    """Memory of each column of a table loaded as is and compacted, see lib.compact_frame"""
+    plain = column_memory(get_storage('sqlite').read(table_name))
+    compact = column_memory(read_table_compact(table_name, backend='sqlite'))
+    report = []
+    for col in plain.index:
+        row = {
+            'column': col,
+            'dtype': plain.at[col, 'dtype'],
+            'bytes': int(plain.at[col, 'bytes']),
+            'compact_dtype': compact.at[col, 'dtype'],
+            'compact_bytes': int(compact.at[col, 'bytes']),
+        }
+        report.append(row)
+        print(
+            f"{table_name}.{col:<20} {row['dtype']:>10} {row['bytes'] / 2 ** 20:8.1f} MiB   "
+            f"{row['compact_dtype']:>10} {row['compact_bytes'] / 2 ** 20:8.1f} MiB"
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic data and benchmark the pages and callbacks")
+    parser.add_argument('--db', default='benchmark.db', help="database file to (re)create and benchmark")
+    parser.add_argument('--rows', type=int, default=100000, help="sales_data rows")
+    parser.add_argument('--polygons', type=int, default=2000, help="geo_data polygons")
+    parser.add_argument('--vertices', type=int, default=32, help="vertices per polygon")
+    parser.add_argument('--repeat', type=int, default=5, help="warm runs per case")
+    parser.add_argument('--edits', type=int, default=100, help="cells changed per save_changes run")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-generate', action='store_true', help="benchmark the existing database as is")
+    parser.add_argument('--storage', default=config.STORAGE_BACKEND, help="storage backend the pages read through")
+    parser.add_argument('--parquet-dir', default='benchmark_parquet', help="directory of the Parquet snapshots")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    config.DB_PATH = args.db
+    config.STORAGE_BACKEND = args.storage
+    config.PARQUET_DIR = args.parquet_dir
+    # Time the callbacks themselves, not a background job or a shared result
+    config.BACKGROUND_CALLBACKS = False
+    close_connections()
+
+    generate = {}
+    if not args.skip_generate:
+        generate = create_synthetic_database(args.rows, args.polygons, args.vertices, args.seed)
+
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': vars(args),
+        'generate_seconds': generate,
+        'cases': run_benchmarks(args.repeat, args.edits, args.seed),
+        'storage_cases': run_storage_benchmarks(args.repeat, args.seed),
+        'column_memory': report_column_memory(),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Application settings, each overridable through an environment variable
+import os
+
+# SQLite database file
+DB_PATH = os.environ.get('DASH_DB_PATH', 'sample_data.db')
+
+# How long a connection waits for a lock before raising "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('DASH_SQLITE_BUSY_TIMEOUT_MS', 5000))
+# Page cache per connection, in KiB
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('DASH_SQLITE_CACHE_SIZE_KB', 64 * 1024))
+# Bytes of the database file to memory-map, 0 to disable
+SQLITE_MMAP_SIZE = int(os.environ.get('DASH_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+# NORMAL is durable across application crashes in WAL mode, FULL also across power loss
+SQLITE_SYNCHRONOUS = os.environ.get('DASH_SQLITE_SYNCHRONOUS', 'NORMAL')
+
+# Where table reads are served from: 'sqlite', or 'parquet' for columnar snapshots
+# of the SQLite tables queried with DuckDB (needs the duckdb package)
+STORAGE_BACKEND = os.environ.get('DASH_STORAGE_BACKEND', 'sqlite')
+# Directory of the Parquet snapshots
+PARQUET_DIR = os.environ.get('DASH_PARQUET_DIR', 'parquet')
+
+# Rows read per chunk when a whole table is loaded into memory
+READ_CHUNK_ROWS = int(os.environ.get('DASH_READ_CHUNK_ROWS', 100000))
+# Loaded tables keep repeated text as categoricals and numbers in the smallest
+# type that holds them exactly; set to 0 for plain object and 64-bit columns
+COMPACT_FRAMES = os.environ.get('DASH_COMPACT_FRAMES', '1') == '1'
+
+# Limits for the in-process data cache
+CACHE_MAX_ENTRIES = int(os.environ.get('DASH_CACHE_MAX_ENTRIES', 32))
+CACHE_MAX_BYTES = int(os.environ.get('DASH_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# How the map draws its areas: 'geojson' embeds them in the figure, 'tiles'
+# loads them as vector tiles, 'auto' switches to tiles above MAP_TILE_THRESHOLD features
+MAP_RENDER_MODE = os.environ.get('DASH_MAP_RENDER_MODE', 'auto')
+MAP_TILE_THRESHOLD = int(os.environ.get('DASH_MAP_TILE_THRESHOLD', 5000))
+
+# Vector tile encoding: coordinate resolution, overlap with neighbouring
+# tiles and simplification tolerance, all in tile units
+TILE_EXTENT = int(os.environ.get('DASH_TILE_EXTENT', 4096))
+TILE_BUFFER = int(os.environ.get('DASH_TILE_BUFFER', 64))
+TILE_SIMPLIFY_UNITS = float(os.environ.get('DASH_TILE_SIMPLIFY_UNITS', 1.0))
+TILE_MAX_ZOOM = int(os.environ.get('DASH_TILE_MAX_ZOOM', 22))
+
+# Rendered tiles are kept in memory, and on disk when a directory is set
+TILE_CACHE_DIR = os.environ.get('DASH_TILE_CACHE_DIR', '')
+TILE_CACHE_MAX_ENTRIES = int(os.environ.get('DASH_TILE_CACHE_MAX_ENTRIES', 10000))
+TILE_CACHE_MAX_BYTES = int(os.environ.get('DASH_TILE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Most areas drawn inline on the map at once; above this only areas in view are sent
+MAP_MAX_FEATURES = int(os.environ.get('DASH_MAP_MAX_FEATURES', 2000))
+
+# When set, every callback request is profiled with cProfile and saved here as a .prof file
+PROFILE_DIR = os.environ.get('DASH_PROFILE_DIR', '')
+
+# Rows fetched from the database per chunk of a table export
+EXPORT_CHUNK_ROWS = int(os.environ.get('DASH_EXPORT_CHUNK_ROWS', 10000))
+
+# Save and ingestion callbacks run as background jobs when diskcache is
+# installed; set to 0 to always run them in the request
+BACKGROUND_CALLBACKS = os.environ.get('DASH_BACKGROUND_CALLBACKS', '1') == '1'
+# Job results and progress, shared by every worker through this directory
+JOBS_DIR = os.environ.get('DASH_JOBS_DIR', '.jobs')
+# Identical jobs started while one is running wait for it instead of repeating
+# the work; its result is kept this long for the waiting jobs to collect
+JOB_RESULT_SECONDS = int(os.environ.get('DASH_JOB_RESULT_SECONDS', 30))
+# A job that hasn't finished after this long no longer holds back identical ones
+JOB_TIMEOUT_SECONDS = int(os.environ.get('DASH_JOB_TIMEOUT_SECONDS', 600))
+
+# Text responses larger than this are gzip compressed, or brotli compressed when
+# the brotli package is installed
+COMPRESSION_MIN_BYTES = int(os.environ.get('DASH_COMPRESSION_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('DASH_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('DASH_BROTLI_QUALITY', 5))
+# Decimal places kept in GeoJSON coordinates sent to the map (6 is about 10 cm)
+GEOJSON_PRECISION = int(os.environ.get('DASH_GEOJSON_PRECISION', 6))
+
+# Seconds between checks for new data when live updates are on
+LIVE_UPDATE_SECONDS = float(os.environ.get('DASH_LIVE_UPDATE_SECONDS', 5))
+
+# Uploaded files are written here until they are ingested
+UPLOAD_DIR = os.environ.get('DASH_UPLOAD_DIR', '.uploads')
+# Rows parsed and written per batch when ingesting an upload
+INGEST_BATCH_ROWS = int(os.environ.get('DASH_INGEST_BATCH_ROWS', 50000))
@@ -0,0 +1,223 @@
+# Streaming table exports, read from the database in bounded chunks
+import csv
+import io
+import json
+import os
+import tempfile
+from urllib.parse import urlencode
+import flask
+import shapely
+from dash import get_relative_path, html
+from src import config
+from src.lib import build_order_clause, build_where_clause, connect, get_table_schema
+
+# Tables that can be exported
+EXPORT_TABLES = ['sales_data', 'geo_data']
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Excel refuses longer cell values
+XLSX_MAX_CELL_LENGTH = 32767
+
+
+def available_formats():
+    """Export formats whose optional dependencies are installed"""
+    formats = ['csv']
+    for fmt, module in [('xlsx', 'openpyxl'), ('parquet', 'pyarrow')]:
+        try:
+            __import__(module)
+            formats.append(fmt)
+        except ImportError:
+            pass
+    return formats
+
+
+def export_url(table_name, fmt, filter_query='', sort_by=None):
+    """URL of a table export applying a DataTable filter_query and sort_by"""
+    args = {}
+    if filter_query:
+        args['filter_query'] = filter_query
+    if sort_by:
+        args['sort_by'] = json.dumps(sort_by)
+    query = f'?{urlencode(args)}' if args else ''
+    return get_relative_path(f'/export/{table_name}.{fmt}') + query
+
+
+def export_links(table_name, filter_query='', sort_by=None):
+    """Download links for every available export format of a table"""
+    return [html.Span("Export: ", style={'fontWeight': 'bold'})] + [
+        html.A(fmt.upper(), href=export_url(table_name, fmt, filter_query, sort_by), style={'marginRight': '10px'})
+        for fmt in available_formats()
+    ]
+
+
+def iter_chunks(table_name, filter_query='', sort_by=None, chunk_rows=None):
+    """Yield (column names, list of row tuples) chunks of a filtered, sorted table"""
+    columns = [name for name, _ in get_table_schema(table_name)]
+    where, params = build_where_clause(filter_query, columns)
+    order = build_order_clause(sort_by, columns)
+
+    # A connection of its own, so the cursor stays open for the whole stream
+    conn = connect()
+    try:
+        cursor = conn.execute(f'SELECT * FROM "{table_name}"{where}{order}', params)
+        names = [d[0] for d in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_rows or config.EXPORT_CHUNK_ROWS)
+            if not rows:
+                break
+            yield names, rows
+    finally:
+        conn.close()
+
+
+def _geometry_as_wkt(names, rows):
+    """Rows with their WKB geometry replaced by WKT, for text formats"""
+    if 'geometry' not in names:
+        return rows
+    at = names.index('geometry')
+    wkt = shapely.to_wkt(shapely.from_wkb([row[at] for row in rows]), rounding_precision=-1)
+    return [row[:at] + (text,) + row[at + 1:] for row, text in zip(rows, wkt.tolist())]
+
+
+def stream_csv(table_name, filter_query='', sort_by=None):
+    """Encode the table as CSV, one block per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in get_table_schema(table_name)])
+    for names, rows in iter_chunks(table_name, filter_query, sort_by):
+        writer.writerows(_geometry_as_wkt(names, rows))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def stream_xlsx(table_name, filter_query='', sort_by=None):
+    """Encode the table as an Excel workbook with a single sheet"""
+    from openpyxl import Workbook
+
+    # Write-only workbooks keep rows in a temporary file instead of in memory;
+    # the zip container can only be sent once it is complete
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(table_name)
+    sheet.append([name for name, _ in get_table_schema(table_name)])
+    for names, rows in iter_chunks(table_name, filter_query, sort_by):
+        for row in _geometry_as_wkt(names, rows):
+            sheet.append([
+                None if isinstance(value, str) and len(value) > XLSX_MAX_CELL_LENGTH else value
+                for value in row
+            ])
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as f:
+            while block := f.read(1024 * 1024):
+                yield block
+    finally:
+        os.remove(path)
+
+
+class _DrainableBuffer(io.RawIOBase):
+    """Write-only file whose contents are handed out as they are written"""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._data.extend(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = bytes(self._data)
+        self._data.clear()
+        return data
+
+
+def _arrow_schema(table_name):
+    """Arrow schema matching a table's declared SQLite column types"""
+    import pyarrow as pa
+
+    fields = []
+    for name, declared in get_table_schema(table_name):
+        declared = (declared or '').upper()
+        if 'INT' in declared:
+            fields.append(pa.field(name, pa.int64()))
+        elif any(t in declared for t in ('REAL', 'FLOA', 'DOUB')):
+            fields.append(pa.field(name, pa.float64()))
+        elif 'BLOB' in declared:
+            fields.append(pa.field(name, pa.binary()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields)
+
+
+def stream_parquet(table_name, filter_query='', sort_by=None):
+    """Encode the table as Parquet, one row group per chunk"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Each chunk becomes a row group, sent as soon as it is written; the
+    # footer follows once the last chunk is done
+    schema = _arrow_schema(table_name)
+    sink = _DrainableBuffer()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    for names, rows in iter_chunks(table_name, filter_query, sort_by):
+        columns = list(zip(*rows))
+        writer.write_table(pa.table(
+            [pa.array(column, type=schema.field(name).type) for name, column in zip(names, columns)],
+            schema=schema
+        ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+EXPORT_WRITERS = {
+    'csv': stream_csv,
+    'xlsx': stream_xlsx,
+    'parquet': stream_parquet,
+}
+
+
+def register_export_routes(server):
+    """Serve filtered, sorted table exports from the Flask server"""
+
+    @server.route('/export/<table_name>.<fmt>')
+    def export_table(table_name, fmt):
+        if table_name not in EXPORT_TABLES or fmt not in EXPORT_WRITERS:
+            flask.abort(404)
+        if fmt not in available_formats():
+            flask.abort(501, f"Exporting {fmt} needs an optional dependency that isn't installed")
+
+        filter_query = flask.request.args.get('filter_query', '')
+        try:
+            sort_by = json.loads(flask.request.args.get('sort_by', '[]'))
+        except ValueError:
+            flask.abort(400, "sort_by must be a JSON list")
+
+        try:
+            build_where_clause(filter_query, [name for name, _ in get_table_schema(table_name)])
+        except ValueError as e:
+            flask.abort(400, str(e))
+
+        stream = EXPORT_WRITERS[fmt](table_name, filter_query, sort_by)
+        return flask.Response(
+            flask.stream_with_context(stream),
+            mimetype=EXPORT_MIMETYPES[fmt],
+            headers={'Content-Disposition': f'attachment; filename="{table_name}.{fmt}"'}
+        )
@@ -0,0 +1,192 @@
+# Uploads of large CSV and GeoJSON files, ingested into sales_data or geo_data
+#
+# Files are sent in chunks to a resumable upload route and written straight to
+# disk, then parsed in bounded batches and written to the table in one
+# transaction, so neither step holds the whole file in memory.
+import json
+import os
+import re
+import time
+import flask
+import pandas as pd
+import shapely
+from src import config
+from src.lib import replace_table_from_batches
+
+# Tables that can be replaced by an upload
+UPLOAD_TABLES = ['sales_data', 'geo_data']
+
+# File extensions of the formats that can be ingested
+UPLOAD_FORMATS = {'.csv': 'csv', '.geojson': 'geojson', '.json': 'geojson'}
+
+# Upload ids are chosen by the browser, so they must be safe as file names
+_UPLOAD_ID = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,127}$')
+
+# Bytes copied from the request to disk, and read from GeoJSON files, at a time
+_COPY_BLOCK = 1024 * 1024
+
+# Whitespace and commas between the features of a GeoJSON array
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def upload_path(upload_id):
+    """Path of the file an upload is written to"""
+    if not _UPLOAD_ID.match(upload_id):
+        raise ValueError(f"Invalid upload id: {upload_id!r}")
+    return os.path.join(config.UPLOAD_DIR, f'{upload_id}.part')
+
+
+def received_bytes(upload_id):
+    """Bytes of an upload received so far"""
+    try:
+        return os.path.getsize(upload_path(upload_id))
+    except FileNotFoundError:
+        return 0
+
+
+def upload_format(filename):
+    """Ingestion format of a file, from its extension"""
+    fmt = UPLOAD_FORMATS.get(os.path.splitext(filename.lower())[1])
+    if fmt is None:
+        raise ValueError(f"Unsupported file type: {filename}; upload a CSV or GeoJSON file")
+    return fmt
+
+
+def register_upload_routes(server):
+    """Serve the resumable upload route from the Flask server
+
+    GET /upload/<id> returns the bytes received so far; PUT /upload/<id>?offset=N
+    appends the request body, which must start where the received bytes end.
+    A client resumes an interrupted upload by asking for the offset first.
+    """
+
+    @server.route('/upload/<upload_id>', methods=['GET'])
+    def upload_status(upload_id):
+        try:
+            return flask.jsonify(received=received_bytes(upload_id))
+        except ValueError as e:
+            flask.abort(400, str(e))
+
+    @server.route('/upload/<upload_id>', methods=['PUT'])
+    def upload_chunk(upload_id):
+        try:
+            path = upload_path(upload_id)
+            offset = int(flask.request.args.get('offset', 0))
+        except ValueError as e:
+            flask.abort(400, str(e))
+        received = received_bytes(upload_id)
+        if offset != received:
+            # A chunk was lost or sent twice; the client continues from here
+            return flask.jsonify(received=received), 409
+
+        os.makedirs(config.UPLOAD_DIR, exist_ok=True)
+        with open(path, 'ab') as f:
+            while block := flask.request.stream.read(_COPY_BLOCK):
+                f.write(block)
+        return flask.jsonify(received=received_bytes(upload_id))
+
+
+def iter_csv_batches(f, batch_rows):
+    """Parse a CSV file in DataFrames of batch_rows rows
+
+    Values are read as text and coerced to the table's types when written. A
+    geometry column is read as WKT, as written by the CSV export.
+    """
+    for batch in pd.read_csv(f, chunksize=batch_rows, dtype=str, keep_default_na=False, na_values=['']):
+        if 'geometry' in batch.columns:
+            wkt = batch['geometry'].astype(object).where(batch['geometry'].notna(), None)
+            batch['geometry'] = shapely.to_wkb(shapely.from_wkt(wkt.to_numpy()))
+        yield batch
+
+
+def iter_geojson_features(f, block_size=_COPY_BLOCK):
+    """Yield the features of a GeoJSON FeatureCollection one at a time, reading the file in blocks"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    # Skip ahead to the features array
+    while True:
+        match = re.search(r'"features"\s*:\s*\[', buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        block = f.read(block_size)
+        if not block:
+            raise ValueError("Not a GeoJSON FeatureCollection: no features array found")
+        # Keep the tail in case the key is split between blocks
+        buffer = buffer[-32:] + block
+
+    # Decode from a position in the buffer, only copying it when a block is added
+    position = 0
+    while True:
+        position = _SEPARATORS.match(buffer, position).end()
+        if buffer.startswith(']', position):
+            return
+        try:
+            feature, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The feature continues in the next block
+            block = f.read(block_size)
+            if not block:
+                raise ValueError("Truncated GeoJSON: the features array isn't closed")
+            buffer = buffer[position:] + block
+            position = 0
+            continue
+        yield feature
+
+
+def iter_geojson_batches(f, batch_rows):
+    """Parse a GeoJSON FeatureCollection in DataFrames of batch_rows features
+
+    Each row holds a feature's properties, its id when the properties have
+    none, and its geometry as WKB, or NULL when the feature has none.
+    """
+    def to_frame(features):
+        batch = pd.DataFrame([feature.get('properties') or {} for feature in features])
+        if 'id' not in batch.columns:
+            batch['id'] = [feature.get('id') for feature in features]
+        # A feature with a null geometry is stored without one
+        geometries = [feature.get('geometry') for feature in features]
+        batch['geometry'] = shapely.to_wkb(shapely.from_geojson(
+            [None if geometry is None else json.dumps(geometry) for geometry in geometries]
+        ))
+        return batch
+
+    features = []
+    for feature in iter_geojson_features(f):
+        features.append(feature)
+        if len(features) == batch_rows:
+            yield to_frame(features)
+            features = []
+    if features:
+        yield to_frame(features)
+
+
+PARSERS = {
+    'csv': iter_csv_batches,
+    'geojson': iter_geojson_batches,
+}
+
+
+def ingest_upload(upload_id, filename, table_name, progress=None):
+    """Replace a table with the rows of a finished upload, then delete the upload
+
+    progress, if given, is called with (bytes parsed, total bytes, rows written,
+    elapsed seconds) after each batch. Returns the same figures once done.
+    """
+    if table_name not in UPLOAD_TABLES:
+        raise ValueError(f"Uploads can't replace {table_name}")
+    parse = PARSERS[upload_format(filename)]
+    path = upload_path(upload_id)
+    total = os.path.getsize(path)
+    start = time.perf_counter()
+
+    with open(path, encoding='utf-8', newline='') as f:
+        def report(rows):
+            if progress:
+                # The parsers read ahead, so this runs slightly ahead of the rows
+                progress(min(os.lseek(f.fileno(), 0, os.SEEK_CUR), total), total, rows, time.perf_counter() - start)
+
+        rows = replace_table_from_batches(table_name, parse(f, config.INGEST_BATCH_ROWS), progress=report)
+
+    os.remove(path)
+    return total, total, rows, time.perf_counter() - start
@@ -0,0 +1,122 @@
+# Long-running callbacks, run by Dash's background callback manager when diskcache
+# is installed (pip install "dash[diskcache]") and in the request otherwise
+import functools
+import hashlib
+import os
+import time
+import uuid
+from dash import callback, DiskcacheManager
+from src import config
+
+_job_cache = None
+_background_manager = None
+_MISSING = object()
+
+
+def get_job_cache():
+    """Get the diskcache shared by every worker's jobs, None when diskcache isn't installed"""
+    global _job_cache
+    if _job_cache is None and config.BACKGROUND_CALLBACKS:
+        try:
+            import diskcache
+        except ImportError:
+            return None
+        _job_cache = diskcache.Cache(config.JOBS_DIR)
+    return _job_cache
+
+
+def get_background_manager():
+    """Get the background callback manager, None when callbacks run in the request"""
+    global _background_manager
+    if _background_manager is None and get_job_cache() is not None:
+        try:
+            _background_manager = DiskcacheManager(get_job_cache())
+        except ImportError:
+            # psutil or multiprocess missing
+            return None
+    return _background_manager
+
+
+def background_callback(*args, progress=None, progress_default=None, cancel=None, **kwargs):
+    """Register a callback that runs as a background job when a manager is available
+
+    When progress outputs are given the function receives set_progress as its
+    first argument, also when it runs in the request (where it does nothing).
+    """
+    def decorator(func):
+        manager = get_background_manager()
+        if manager is not None:
+            return callback(
+                *args, background=True, manager=manager, progress=progress,
+                progress_default=progress_default, cancel=cancel, **kwargs
+            )(func)
+        if progress is None:
+            return callback(*args, **kwargs)(func)
+
+        @functools.wraps(func)
+        def run_in_request(*func_args, **func_kwargs):
+            return func(lambda value: None, *func_args, **func_kwargs)
+
+        callback(*args, **kwargs)(run_in_request)
+        return func
+
+    return decorator
+
+
+def run_deduplicated(name, key, func):
+    """Run func once for identical jobs in flight at the same time, sharing its result
+
+    Jobs are identical when they have the same name and key. Only jobs that
+    were waiting while it ran get its result; a job started after it finished
+    runs again. The result goes through the job cache, so it has to be picklable.
+    """
+    cache = get_job_cache()
+    if cache is None:
+        return func()
+
+    job_key = f"job:{name}:{hashlib.sha256(repr(key).encode()).hexdigest()}"
+    lock_key = f"{job_key}:owner"
+    while True:
+        run_id = f"{os.getpid()}:{uuid.uuid4().hex}"
+        # The first job takes ownership, the others wait for its result
+        if cache.add(lock_key, run_id, expire=config.JOB_TIMEOUT_SECONDS):
+            return _run_owned(cache, job_key, lock_key, run_id, func)
+        owner = cache.get(lock_key)
+        if owner is None:
+            continue  # Finished in the meantime, too late to share its result
+        result = _wait_for(cache, job_key, lock_key, owner)
+        if result is not _MISSING:
+            return result
+        # The owner was cancelled or crashed before finishing, so run it again
+
+
+def _run_owned(cache, job_key, lock_key, run_id, func):
+    try:
+        result = func()
+        # Keyed by the run, which only the jobs waiting on it know
+        cache.set(f"{job_key}:{run_id}", result, expire=config.JOB_RESULT_SECONDS)
+        return result
+    finally:
+        if cache.get(lock_key) == run_id:
+            cache.delete(lock_key)
+
+
+def _wait_for(cache, job_key, lock_key, owner):
+    """Wait for the run of another job to finish and return its result, _MISSING if it didn't"""
+    while cache.get(lock_key) == owner:
+        if not _process_alive(int(owner.split(':')[0])):
+            cache.delete(lock_key)
+            break
+        time.sleep(0.1)
+    # Several jobs may be waiting, so the result is left to expire rather than taken
+    return cache.get(f"{job_key}:{owner}", _MISSING)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Alive, owned by another user
+    return True
@@ -0,0 +1,105 @@
+# Extra map layers drawn over the geo_data areas
+#
+# Each layer reads its own table and builds its own trace, cached per revision
+# of that table, so a write to one layer's table leaves the others cached. The
+# map page keeps a hidden placeholder trace per layer and only loads a layer
+# the first time it is shown.
+import json
+import numpy as np
+import plotly.graph_objects as go
+import shapely
+from plotly.io.json import to_json_plotly
+from src import config
+from src.lib import data_cache, get_storage, get_table_revision, to_feature_collection
+from src.metrics import instrument
+
+# Registered layers by id, in the order of their traces
+MAP_LAYERS = {}
+
+
+def register_layer(layer_id, name, table_name, build_trace, visible=False, opacity=0.6):
+    """Add a layer drawn by build_trace(df, name, opacity) from the rows of table_name"""
+    MAP_LAYERS[layer_id] = {
+        'id': layer_id,
+        'name': name,
+        'table': table_name,
+        'build_trace': build_trace,
+        'visible': visible,
+        'opacity': opacity,
+    }
+
+
+def polygon_trace(color, hover_columns):
+    """Build function for a layer of polygons with a WKB geometry column"""
+    def build_trace(df, name, opacity):
+        df = df.assign(geometry=shapely.from_wkb(df['geometry']))
+        return go.Choroplethmap(
+            geojson=to_feature_collection(df),
+            locations=df['id'].to_numpy(),
+            featureidkey='properties.id',
+            z=np.zeros(len(df)),
+            colorscale=[[0, color], [1, color]],
+            showscale=False,
+            marker_opacity=opacity,
+            customdata=df[hover_columns].to_numpy(),
+            hovertemplate=_hover_template(hover_columns),
+            name=name,
+            showlegend=True
+        )
+    return build_trace
+
+
+def point_trace(color, hover_columns):
+    """Build function for a layer of points with lon and lat columns"""
+    def build_trace(df, name, opacity):
+        return go.Scattermap(
+            lon=df['lon'].to_numpy(),
+            lat=df['lat'].to_numpy(),
+            mode='markers',
+            marker=dict(size=10, color=color, opacity=opacity),
+            customdata=df[hover_columns].to_numpy(),
+            hovertemplate=_hover_template(hover_columns),
+            name=name,
+            showlegend=True
+        )
+    return build_trace
+
+
+def _hover_template(columns):
+    return "<b>%{customdata[0]}</b>" + ''.join(
+        f"<br>{col.replace('_', ' ').capitalize()}: %{{customdata[{i}]}}" for i, col in enumerate(columns[1:], start=1)
+    ) + "<extra></extra>"
+
+
+def placeholder_trace(layer_id):
+    """Hidden, empty trace holding a layer's place until it is first shown"""
+    layer = MAP_LAYERS[layer_id]
+    return go.Scattermap(lon=[], lat=[], name=layer['name'], visible=False, showlegend=False)
+
+
+@instrument
+def get_layer_trace(layer_id):
+    """Get a layer's trace as a plotly.js dict, built once per revision of its table"""
+    layer = MAP_LAYERS[layer_id]
+    version = (config.DB_PATH, get_table_revision(layer['table']))
+    return data_cache.get_or_load(
+        f'layer:{layer_id}', version, lambda: _build_layer_trace(layer), sizeof=_trace_size
+    )['trace']
+
+
+def _build_layer_trace(layer):
+    df = get_storage().read(layer['table'])
+    trace = layer['build_trace'](df, layer['name'], layer['opacity'])
+    # Going through a figure encodes the arrays as typed arrays, which a
+    # trace sent on its own through Patch wouldn't be
+    encoded = to_json_plotly(go.Figure(data=[trace]).to_dict()['data'][0])
+    return {'trace': json.loads(encoded), 'bytes': len(encoded)}
+
+
+def _trace_size(cached):
+    # Roughly what the decoded dict holds
+    return cached['bytes'] * 4
+
+
+register_layer('zones', 'Zones', 'zone_data', polygon_trace('green', ['name', 'zone_type']))
+register_layer('pois', 'Points of interest', 'poi_data', point_trace('purple', ['name', 'category']))
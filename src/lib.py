@@ -1,13 +1,269 @@
+import os
 import sqlite3
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
-import geopandas as gpd
+import shapely
+from shapely.geometry import shape
 import json
+from src import config
+from src.metrics import instrument
+from src.storage import ParquetStorage, SQLiteStorage
+
+
+# Per-thread connections, reopened after a fork (e.g. gunicorn --preload)
+# or after close_connections()
+_local = threading.local()
+_connections_lock = threading.Lock()
+# Held weakly, so a connection goes away with the thread that opened it
+_connections = weakref.WeakSet()
+_generation = 0
+
+
+class _ThreadConnection:
+    """A thread's pooled connection, closed when the thread ends and drops its local data"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __del__(self):
+        self.conn.close()
+
+
+def connect(path=None, **kwargs):
+    """Open a new SQLite connection configured for concurrent access"""
+    conn = sqlite3.connect(
+        path or config.DB_PATH,
+        timeout=config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,  # Transactions are explicit, see transaction()
+        **kwargs
+    )
+    # WAL lets readers proceed while a writer commits
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA cache_size={-config.SQLITE_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}')
+    return conn
+
+
+def get_connection():
+    """Get this thread's pooled connection to the configured database"""
+    owner = (os.getpid(), config.DB_PATH, _generation)
+    if getattr(_local, 'owner', None) != owner:
+        # Only ever used by this thread, but may be closed from another
+        pooled = _ThreadConnection(connect(check_same_thread=False))
+        _local.pooled, _local.owner = pooled, owner
+        with _connections_lock:
+            _connections.add(pooled)
+    return _local.pooled.conn
+
+
+def close_connections():
+    """Close every pooled connection, e.g. before forking workers or when switching databases"""
+    global _version_conn, _generation
+    with _connections_lock:
+        for pooled in list(_connections):
+            pooled.conn.close()
+        _connections.clear()
+        _generation += 1
+    with _version_lock:
+        if _version_conn is not None:
+            _version_conn.close()
+            _version_conn = None
+
+
+@contextmanager
+def transaction():
+    """Run the enclosed statements as one write transaction on this thread's connection"""
+    conn = get_connection()
+    # IMMEDIATE takes the write lock up front, so two writers wait on the
+    # busy timeout instead of failing when upgrading a read lock
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    if conn.in_transaction:
+        conn.execute('COMMIT')
+
+
+class DataCache:
+    """LRU cache of query results, keyed by the database version they were read at"""
+
+    def __init__(self, max_entries=config.CACHE_MAX_ENTRIES, max_bytes=config.CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, name, version, loader, sizeof=None):
+        """Return the cached value for name at version, loading it on a miss"""
+        key = (name, version)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+
+        value = loader()
+        size = (sizeof or _sizeof)(value)
+
+        with self._lock:
+            # Entries for older versions of the same data can never be hit again
+            for stale in [k for k in self._entries if k[0] == name and k != key]:
+                self._discard(stale)
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (value, size)
+            self._total_bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+            ):
+                self._discard(next(iter(self._entries)))
+        return value
+
+    def _discard(self, key):
+        _, size = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+def _sizeof(value):
+    """Approximate in-memory size of a cached value"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, dict):
+        return sum(_sizeof(v) for v in value.values())
+    if isinstance(value, bytes):
+        return len(value)
+    return 0
+
+
+data_cache = DataCache()
+
+# Bumped by every write made through this module
+_write_counter = 0
+_version_lock = threading.Lock()
+_version_conn = None
+_version_owner = None
+
+
+def bump_write_counter():
+    """Record that this process has written to the database"""
+    global _write_counter
+    with _version_lock:
+        _write_counter += 1
+
+
+def get_data_version():
+    """Get a token that changes whenever the database contents change"""
+    # PRAGMA data_version only moves for commits made by *other* connections,
+    # so it is read from a long-lived connection that never writes itself
+    data_version = _read_pragma('data_version')
+    return (config.DB_PATH, _write_counter, data_version)
+
+
+def get_schema_version():
+    """Get SQLite's schema cookie, which changes whenever a table is created, altered or dropped"""
+    return _read_pragma('schema_version')
+
+
+def _read_pragma(name):
+    global _version_conn, _version_owner
+    with _version_lock:
+        if _version_conn is None or _version_owner != (os.getpid(), config.DB_PATH):
+            _version_conn = connect(check_same_thread=False)
+            _version_owner = (os.getpid(), config.DB_PATH)
+        return _version_conn.execute(f'PRAGMA {name}').fetchone()[0]
+
+
+def clear_data_cache():
+    """Drop every cached query result"""
+    data_cache.clear()
+
+
+def bump_table_revision(conn, table_name):
+    """Record a change to a table inside the caller's write transaction"""
+    # Unlike the in-process version token, revisions are shared by every process
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS table_revisions (table_name TEXT PRIMARY KEY, revision INTEGER NOT NULL)'
+    )
+    conn.execute(
+        'INSERT INTO table_revisions (table_name, revision) VALUES (?, 1) '
+        'ON CONFLICT (table_name) DO UPDATE SET revision = revision + 1',
+        (table_name,)
+    )
+
+
+def get_table_revision(table_name):
+    """Get the number of recorded changes to a table, 0 if it has none"""
+    return data_cache.get_or_load(f'revision:{table_name}', get_data_version(), lambda: _read_table_revision(table_name))
+
+
+def _read_table_revision(table_name):
+    try:
+        row = get_connection().execute(
+            'SELECT revision FROM table_revisions WHERE table_name = ?', (table_name,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return 0  # No table written since revisions were introduced
+    return row[0] if row else 0
+
+
+_storages = {}
+
+
+def get_storage(backend=None):
+    """Get the storage backend table reads go through, see config.STORAGE_BACKEND"""
+    backend = backend or config.STORAGE_BACKEND
+    key = (backend, config.DB_PATH, config.PARQUET_DIR)
+    if key not in _storages:
+        if backend == 'sqlite':
+            _storages[key] = SQLiteStorage(get_connection)
+        elif backend == 'parquet':
+            directory = os.path.join(config.PARQUET_DIR, os.path.splitext(os.path.basename(config.DB_PATH))[0])
+            _storages[key] = ParquetStorage(directory, get_storage('sqlite'), get_table_revision)
+        else:
+            raise ValueError(f"Unknown storage backend: {backend}")
+    return _storages[key]
+
+
+def read_table(table_name, columns=None, filters=None):
+    """Read the given columns of a table's rows matching every (column, operator, value) filter
+
+    Results are cached per database version; treat the returned frame as read-only.
+    """
+    key = f'table:{table_name}:{columns}:{filters}'
+    return data_cache.get_or_load(
+        key, get_data_version(), lambda: get_storage().read(table_name, columns=columns, filters=filters)
+    )
 
 
 def create_sample_database():
     """Create a sample SQLite database with sample data"""
-    conn = sqlite3.connect('sample_data.db')
-    
     # Create sample data
     data = {
         'id': range(1, 21),
@@ -19,34 +275,427 @@ def create_sample_database():
     }
     
     df = pd.DataFrame(data)
-    df.to_sql('sales_data', conn, if_exists='replace', index=False)
-    conn.close()
+    with transaction() as conn:
+        replace_table(conn, 'sales_data', df)
+        ensure_id_index(conn, 'sales_data')
+        rebuild_summary_tables(conn)
+        bump_table_revision(conn, 'sales_data')
+    bump_write_counter()
     print("Sample database created successfully!")
 
 
+@instrument
 def read_data_from_db():
-    """Read data from SQLite database"""
-    conn = sqlite3.connect('sample_data.db')
-    query = "SELECT * FROM sales_data"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    """Read data from SQLite database
 
+    Results are cached per database version; treat the returned frame as read-only.
+    With config.COMPACT_FRAMES, repeated text comes back as categoricals and
+    numbers in narrower types holding the same values, see compact_frame.
+    """
+    return data_cache.get_or_load('sales_data', get_data_version(), _read_data_from_db)
 
-def get_column_types():
-    """Get the data types of columns from the database"""
-    df = read_data_from_db()
-    return df.dtypes.to_dict()
 
+def _read_data_from_db():
+    if config.COMPACT_FRAMES:
+        return read_table_compact('sales_data')
+    return get_storage().read('sales_data')
 
-def save_data_to_db(df):
-    """Save dataframe to SQLite database preserving original data types"""
-    # Get original column types
-    original_types = get_column_types()
-    
-    # Convert columns back to their original types
+
+def get_table_schema(table_name):
+    """Get (column name, declared type) pairs for a table, cached until the schema changes"""
+    return data_cache.get_or_load(
+        f'schema:{table_name}', get_schema_version(), lambda: _read_table_schema(table_name)
+    )
+
+
+def _read_table_schema(table_name):
+    conn = get_connection()
+    return [(row[1], row[2].upper()) for row in conn.execute(f'PRAGMA table_info("{table_name}")')]
+
+
+def get_table_columns(table_name):
+    """Get the column names of a table without reading its rows"""
+    return [name for name, _ in get_table_schema(table_name)]
+
+
+# DataTable relational filter operators mapped to their SQL equivalents
+RELATIONAL_OPERATORS = {
+    'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>=',
+    '=': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>=',
+}
+# DataTable filter operators taking a value, longest spellings first so that
+# e.g. '>=' is matched before '>'
+FILTER_OPERATORS = ['datestartswith', 'contains', 'ge', 'le', 'lt', 'gt', 'ne', 'eq', '>=', '<=', '!=', '<', '>', '=']
+# DataTable filter operators without a value
+UNARY_OPERATORS = ['is blank', 'is nil']
+
+
+def split_filter_part(filter_part):
+    """Split a single DataTable filter expression into (column, operator, value)
+
+    The operator keeps an 'i' prefix when it is case-insensitive; 's' and no
+    prefix are case-sensitive. Operators without a value come with None.
+    Raises ValueError for filters that can't be applied.
+    """
+    filter_part = filter_part.strip()
+    if not filter_part.startswith('{') or '}' not in filter_part:
+        raise ValueError(f"Unsupported filter: {filter_part}")
+    name, rest = filter_part[1:].split('}', 1)
+    rest = rest.strip()
+    if rest in UNARY_OPERATORS:
+        return name, rest, None
+
+    for operator in FILTER_OPERATORS:
+        for prefix in ('', 's', 'i'):
+            spelled = prefix + operator
+            if not rest.startswith(spelled):
+                continue
+            value_part = rest[len(spelled):].strip()
+            if operator.isalpha() and value_part == rest[len(spelled):]:
+                # A word operator must be followed by whitespace
+                continue
+
+            if value_part and value_part[0] == value_part[-1] and value_part[0] in ('"', "'", '`'):
+                value = value_part[1:-1].replace('\\' + value_part[0], value_part[0])
+            elif operator in ('contains', 'datestartswith'):
+                value = value_part  # Matched as text, 5.0 stays 5.0
+            else:
+                try:
+                    value = float(value_part)
+                    if value.is_integer():
+                        value = int(value)
+                except ValueError:
+                    value = value_part
+            return name, ('i' if prefix == 'i' else '') + operator, value
+
+    raise ValueError(f"Unsupported filter operator in: {filter_part}")
+
+
+def _escape_like(value):
+    return str(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def filter_condition(column, operator, value):
+    """SQL condition and parameters of a filter split by split_filter_part"""
+    col = f'"{column}"'
+    if operator == 'is blank':
+        return f"({col} IS NULL OR {col} = '')", []
+    if operator == 'is nil':
+        return f"{col} IS NULL", []
+
+    insensitive = operator.startswith('i')
+    operator = operator[1:] if insensitive else operator
+    if operator in ('contains', 'datestartswith'):
+        if insensitive:
+            # LIKE ignores the case of ASCII letters in SQLite; wildcards typed
+            # by the user are matched literally
+            pattern = _escape_like(value) + '%'
+            if operator == 'contains':
+                pattern = '%' + pattern
+            return f"{col} LIKE ? ESCAPE '\\'", [pattern]
+        if operator == 'contains':
+            return f"instr({col}, ?) > 0", [str(value)]
+        return f"instr({col}, ?) = 1", [str(value)]
+    collate = ' COLLATE NOCASE' if insensitive else ''
+    return f"{col}{collate} {RELATIONAL_OPERATORS[operator]} ?", [value]
+
+
+def build_where_clause(filter_query, columns):
+    """Translate a DataTable filter_query into a parameterized SQL WHERE clause
+
+    Raises ValueError for filters that can't be applied, rather than leaving them out.
+    """
+    conditions = []
+    params = []
+    for filter_part in (filter_query or '').split(' && '):
+        if not filter_part.strip():
+            continue
+        col, operator, value = split_filter_part(filter_part)
+        # Only known columns may be interpolated into the SQL
+        if col not in columns:
+            raise ValueError(f"Unknown column in filter: {col}")
+        condition, condition_params = filter_condition(col, operator, value)
+        conditions.append(condition)
+        params.extend(condition_params)
+
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+    return where, params
+
+
+def build_order_clause(sort_by, columns):
+    """Translate a DataTable sort_by list into a SQL ORDER BY clause"""
+    terms = [
+        f'"{s["column_id"]}" {"DESC" if s.get("direction") == "desc" else "ASC"}'
+        for s in (sort_by or [])
+        if s.get('column_id') in columns
+    ]
+    # Tie-break on the primary key so that pages are stable
+    if 'id' in columns and not any(s.get('column_id') == 'id' for s in (sort_by or [])):
+        terms.append('"id" ASC')
+    return f" ORDER BY {', '.join(terms)}" if terms else ''
+
+
+def build_page_query(table_name, columns, page_current, page_size, sort_by=None, filter_query=''):
+    """Build the SQL and parameters for one page of a filtered, sorted table"""
+    where, params = build_where_clause(filter_query, columns)
+    order = build_order_clause(sort_by, columns)
+    query = f'SELECT * FROM "{table_name}"{where}{order} LIMIT ? OFFSET ?'
+    count_query = f'SELECT COUNT(*) FROM "{table_name}"{where}'
+    return query, params + [page_size, page_current * page_size], count_query, params
+
+
+@instrument
+def read_page_from_db(page_current, page_size, sort_by=None, filter_query='', table_name='sales_data'):
+    """Read a single page of a table, returning the rows and the total matching row count"""
+    columns = get_table_columns(table_name)
+    query, params, count_query, count_params = build_page_query(
+        table_name, columns, page_current, page_size, sort_by, filter_query
+    )
+
+    conn = get_connection()
+    df = pd.read_sql_query(query, conn, params=params)
+    total = conn.execute(count_query, count_params).fetchone()[0]
+    return df, total
+
+
+# Columns of sales_data whose sales totals are kept in sales_summary
+SUMMARY_DIMENSIONS = ['product', 'region']
+# Columns whose combinations are also kept in sales_summary, under the 'cube'
+# dimension with a JSON array key, for the aggregate cube (see read_sales_cube)
+CUBE_DIMENSIONS = ['product', 'region', 'quarter']
+
+
+def _cube_key(row=None):
+    """SQL expression of a row's key in the 'cube' dimension, for a trigger's row or a query"""
+    columns = [f'{row}.{dim}' if row else f'"{dim}"' for dim in CUBE_DIMENSIONS]
+    return f"json_array({', '.join(columns)})"
+
+
+def _summary_upsert(row, sign):
+    """SQL applying one row's contribution (sign=1 add, sign=-1 remove) to sales_summary"""
+    # The headline totals live under the pseudo-dimension '*'
+    targets = [("'*'", "''")] + [(f"'{dim}'", f'{row}.{dim}') for dim in SUMMARY_DIMENSIONS]
+    targets.append(("'cube'", _cube_key(row)))
+    return '\n'.join(f"""
+        INSERT INTO sales_summary (dimension, key, row_count, sales_count, total_sales)
+        SELECT {dim}, {key}, {sign}, {sign} * ({row}.sales IS NOT NULL), {sign} * COALESCE({row}.sales, 0)
+        WHERE {key} IS NOT NULL
+        ON CONFLICT (dimension, key) DO UPDATE SET
+            row_count = row_count + excluded.row_count,
+            sales_count = sales_count + excluded.sales_count,
+            total_sales = total_sales + excluded.total_sales;""" for dim, key in targets)
+
+
+def create_summary_tables(conn):
+    """Create the sales_summary table and the triggers that keep it up to date"""
+    # One statement at a time: executescript would commit an open transaction
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sales_summary (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            sales_count INTEGER NOT NULL DEFAULT 0,
+            total_sales REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, key)
+        )
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS sales_summary_insert AFTER INSERT ON sales_data BEGIN
+            {_summary_upsert('NEW', 1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS sales_summary_delete AFTER DELETE ON sales_data BEGIN
+            {_summary_upsert('OLD', -1)}
+            DELETE FROM sales_summary WHERE row_count <= 0;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS sales_summary_update AFTER UPDATE ON sales_data BEGIN
+            {_summary_upsert('OLD', -1)}
+            {_summary_upsert('NEW', 1)}
+            DELETE FROM sales_summary WHERE row_count <= 0;
+        END
+    """)
+
+
+def rebuild_summary_tables(conn):
+    """Recompute sales_summary from scratch with SQL aggregates
+
+    Needed whenever sales_data is replaced wholesale, since that drops the triggers.
+    """
+    # Triggers from before a dimension was added are replaced
+    for trigger in ('insert', 'delete', 'update'):
+        conn.execute(f'DROP TRIGGER IF EXISTS sales_summary_{trigger}')
+    create_summary_tables(conn)
+    conn.execute("DELETE FROM sales_summary")
+    conn.execute("""
+        INSERT INTO sales_summary (dimension, key, row_count, sales_count, total_sales)
+        SELECT '*', '', COUNT(*), COUNT(sales), COALESCE(SUM(sales), 0) FROM sales_data
+    """)
+    for dim in SUMMARY_DIMENSIONS:
+        conn.execute(f"""
+            INSERT INTO sales_summary (dimension, key, row_count, sales_count, total_sales)
+            SELECT '{dim}', "{dim}", COUNT(*), COUNT(sales), COALESCE(SUM(sales), 0)
+            FROM sales_data WHERE "{dim}" IS NOT NULL GROUP BY "{dim}"
+        """)
+    conn.execute(f"""
+        INSERT INTO sales_summary (dimension, key, row_count, sales_count, total_sales)
+        SELECT 'cube', {_cube_key()}, COUNT(*), COUNT(sales), COALESCE(SUM(sales), 0)
+        FROM sales_data GROUP BY {', '.join(f'"{dim}"' for dim in CUBE_DIMENSIONS)}
+    """)
+
+
+def _summary_is_current(conn):
+    """Check that sales_summary and all of its triggers exist, including the cube dimension"""
+    definitions = dict(conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE name LIKE 'sales_summary%'"
+    ).fetchall())
+    required = {'sales_summary', 'sales_summary_insert', 'sales_summary_delete', 'sales_summary_update'}
+    return required <= definitions.keys() and "'cube'" in definitions['sales_summary_insert']
+
+
+@instrument
+def read_sales_summary():
+    """Read headline statistics and per-dimension sales totals from the summary table"""
+    return data_cache.get_or_load('sales_summary', get_data_version(), _read_sales_summary)
+
+
+def _read_sales_summary():
+    conn = get_connection()
+    if not _summary_is_current(conn):
+        with transaction() as conn:
+            rebuild_summary_tables(conn)
+    summary = pd.read_sql_query(
+        "SELECT dimension, key, row_count, sales_count, total_sales FROM sales_summary ORDER BY dimension, key",
+        conn
+    )
+
+    totals = summary[summary['dimension'] == '*']
+    total_records = int(totals['row_count'].sum())
+    sales_count = int(totals['sales_count'].sum())
+    total_sales = float(totals['total_sales'].sum())
+
+    result = {
+        'total_records': total_records,
+        'total_sales': total_sales,
+        'average_sales': total_sales / sales_count if sales_count else float('nan'),
+    }
+    for dim in SUMMARY_DIMENSIONS:
+        rows = summary[summary['dimension'] == dim]
+        result[f'by_{dim}'] = pd.DataFrame({
+            dim: rows['key'].to_numpy(),
+            'sales': rows['total_sales'].to_numpy(),
+        })
+    return result
+
+
+@instrument
+def read_sales_cube():
+    """Get row counts, sales counts and sales totals per product x region x quarter
+
+    Returns {'labels': {dimension: values along its axis}, 'row_count',
+    'sales_count', 'total_sales'} with NumPy arrays of shape (products,
+    regions, quarters). Missing values are labelled None. Built once per
+    database version; slice it with slice_sales_cube.
+    """
+    return data_cache.get_or_load('sales_cube', get_data_version(), _build_sales_cube, sizeof=_cube_size)
+
+
+def _build_sales_cube():
+    conn = get_connection()
+    if not _summary_is_current(conn):
+        with transaction() as conn:
+            rebuild_summary_tables(conn)
+    # One summary row per combination present, kept current by the triggers
+    cells = pd.read_sql_query(
+        "SELECT key, row_count, sales_count, total_sales FROM sales_summary WHERE dimension = 'cube'", conn
+    )
+    keys = [json.loads(key) for key in cells['key']]
+
+    labels, codes = {}, []
+    for axis, dim in enumerate(CUBE_DIMENSIONS):
+        dim_codes, uniques = pd.factorize(pd.Series([key[axis] for key in keys], dtype=object), sort=True)
+        labels[dim] = uniques.tolist()
+        if (dim_codes < 0).any():
+            dim_codes[dim_codes < 0] = len(labels[dim])
+            labels[dim].append(None)
+        codes.append(dim_codes)
+
+    shape = tuple(len(labels[dim]) for dim in CUBE_DIMENSIONS)
+    cube = {'labels': labels}
+    for measure in ['row_count', 'sales_count', 'total_sales']:
+        values = np.zeros(shape, dtype=np.int64 if measure.endswith('count') else np.float64)
+        if len(cells):
+            values[tuple(codes)] = cells[measure].to_numpy()
+        cube[measure] = values
+    return cube
+
+
+def _cube_size(cube):
+    return cube['row_count'].nbytes * 3
+
+
+def slice_sales_cube(cube, filters=None):
+    """Statistics and per-dimension sales totals of the rows matching filters ({dimension: value})
+
+    Returns the same keys as read_sales_summary plus one by_<dimension> frame
+    per cube dimension. Each by_<dimension> total ignores the filter on its own
+    dimension, so a chart keeps all of its bars while the other charts follow
+    its selection.
+    """
+    filters = {dim: value for dim, value in (filters or {}).items() if value is not None}
+    masks = [
+        np.array([label == filters[dim] for label in cube['labels'][dim]], dtype=bool)
+        if dim in filters else np.ones(len(cube['labels'][dim]), dtype=bool)
+        for dim in CUBE_DIMENSIONS
+    ]
+
+    def selected(measure, unfiltered_axis=None):
+        for axis, mask in enumerate(masks):
+            if axis != unfiltered_axis:
+                measure = measure.compress(mask, axis=axis)
+        return measure
+
+    total_records = int(selected(cube['row_count']).sum())
+    sales_count = int(selected(cube['sales_count']).sum())
+    total_sales = float(selected(cube['total_sales']).sum())
+    result = {
+        'total_records': total_records,
+        'total_sales': total_sales,
+        'average_sales': total_sales / sales_count if sales_count else float('nan'),
+    }
+    for axis, dim in enumerate(CUBE_DIMENSIONS):
+        other_axes = tuple(a for a in range(len(CUBE_DIMENSIONS)) if a != axis)
+        totals = selected(cube['total_sales'], axis).sum(axis=other_axes)
+        # Like the summary table without missing keys; values filtered out by
+        # the other dimensions stay as zeros, so the charts keep their categories
+        keep = [label is not None for label in cube['labels'][dim]]
+        result[f'by_{dim}'] = pd.DataFrame({
+            dim: [label for label, k in zip(cube['labels'][dim], keep) if k],
+            'sales': totals[np.array(keep, dtype=bool)],
+        })
+    return result
+
+
+def get_column_types(table_name='sales_data'):
+    """Get the data types of columns from the database schema"""
+    column_types = {}
+    for name, declared in get_table_schema(table_name):
+        # SQLite type affinity rules, see https://www.sqlite.org/datatype3.html
+        if 'INT' in declared:
+            column_types[name] = np.dtype('int64')
+        elif any(t in declared for t in ('REAL', 'FLOA', 'DOUB')):
+            column_types[name] = np.dtype('float64')
+        else:
+            column_types[name] = np.dtype('object')
+    return column_types
+
+
+def coerce_to_column_types(df, column_types):
+    """Convert dataframe columns back to their database types"""
     df = df.copy()  # Don't modify the original
-    for col, dtype in original_types.items():
+    for col, dtype in column_types.items():
         if col in df.columns:
             try:
                 if pd.api.types.is_numeric_dtype(dtype):
@@ -56,47 +705,530 @@ def save_data_to_db(df):
                     if pd.api.types.is_integer_dtype(dtype):
                         df[col] = df[col].astype('Int64')  # Nullable integer
                 else:
-                    # Keep as string/object
-                    df[col] = df[col].astype(str)
+                    # Keep as string/object, leaving missing values as NULL
+                    values = df[col]
+                    df[col] = values.astype(str).where(values.notna(), None)
             except Exception as e:
                 print(f"Warning: Could not convert column {col}: {e}")
-    
-    conn = sqlite3.connect('sample_data.db')
-    df.to_sql('sales_data', conn, if_exists='replace', index=False)
-    conn.close()
+    return df
+
+
+def compact_frame(df, column_types):
+    """Store a frame's repeated text as categoricals and its numbers in the smallest type holding them exactly
+
+    column_types (see get_column_types) says which columns are numeric, so a
+    text column that happens to hold digits stays text.
+    """
+    df = df.copy(deep=False)  # Columns are replaced, not modified
+    for col in df.columns:
+        series = df[col]
+        declared = column_types.get(col, np.dtype('object'))
+        if pd.api.types.is_integer_dtype(series.dtype):
+            df[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series.dtype):
+            # REAL columns, and INTEGER ones with missing values
+            narrow = series.astype('float32')
+            if np.array_equal(narrow.to_numpy(dtype='float64'), series.to_numpy(), equal_nan=True):
+                df[col] = narrow
+        elif declared == np.dtype('object') and pd.api.types.infer_dtype(series, skipna=True) == 'string':
+            # Sorted categories, so the column sorts like the text it holds
+            codes, categories = pd.factorize(series, sort=True)
+            if len(categories) * 2 <= len(series):
+                df[col] = pd.Categorical.from_codes(codes, categories=categories)
+    return df
+
+
+def concat_compact(chunks):
+    """Join compacted chunks, keeping a column categorical when it is in every chunk"""
+    for col in chunks[0].columns:
+        parts = [chunk[col] for chunk in chunks]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            # Chunks only concatenate as categoricals with the same categories
+            categories = pd.api.types.union_categoricals(
+                [part.array for part in parts], sort_categories=True
+            ).categories
+            for chunk in chunks:
+                chunk[col] = chunk[col].cat.set_categories(categories)
+        elif any(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            for chunk in chunks:
+                chunk[col] = chunk[col].astype(object)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_table_compact(table_name, chunk_rows=None, backend=None):
+    """Read a whole table in chunks into a memory-compact frame, see compact_frame
+
+    Each chunk is compacted as it is read, so the table is never held in
+    memory with a Python object per text value.
+    """
+    column_types = get_column_types(table_name)
+    chunks = [
+        compact_frame(chunk, column_types)
+        for chunk in get_storage(backend).read_chunks(table_name, chunk_rows or config.READ_CHUNK_ROWS)
+    ]
+    if not chunks:
+        return pd.DataFrame(columns=get_table_columns(table_name))
+    return concat_compact(chunks)
+
+
+def column_memory(df):
+    """Memory each column of a frame takes, with its dtype, largest first"""
+    return pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'bytes': df.memory_usage(deep=True, index=False),
+    }).sort_values('bytes', ascending=False)
+
+
+def ensure_id_index(conn, table_name):
+    """Create the unique index on id that keyed writes rely on; False if ids are not unique"""
+    try:
+        conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table_name}_id" ON "{table_name}" (id)')
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+
+def diff_frames(stored, df, key='id'):
+    """Compare two frames by key, returning (inserted/updated rows, deleted keys)"""
+    stored = stored.set_index(key)
+    new = df.set_index(key)
+    columns = [col for col in new.columns if col in stored.columns]
+
+    added = new.index.difference(stored.index)
+    deleted = stored.index.difference(new.index)
+    common = new.index.intersection(stored.index)
+
+    # Positional comparison, as the two key indexes may differ in dtype
+    old_rows = stored.loc[common, columns].reset_index(drop=True)
+    new_rows = new.loc[common, columns].reset_index(drop=True)
+    changed = pd.Series(False, index=new_rows.index)
+    for col in columns:
+        both_missing = old_rows[col].isna() & new_rows[col].isna()
+        equal = (old_rows[col] == new_rows[col]).fillna(False).astype(bool)
+        changed |= ~(equal | both_missing)
+
+    upserts = new.loc[added.append(common[changed.to_numpy()])].reset_index()
+    return upserts, list(deleted)
+
+
+def _sql_rows(df):
+    """Rows of a dataframe as tuples of plain Python values for sqlite3"""
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def replace_table(conn, table_name, df, dtype=None):
+    """Drop and recreate a table from a dataframe inside the caller's transaction"""
+    # Same column types as DataFrame.to_sql, which would commit part way through
+    conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    conn.execute(pd.io.sql.get_schema(df, table_name, con=conn, dtype=dtype))
+    column_list = ', '.join(f'"{col}"' for col in df.columns)
+    placeholders = ', '.join('?' for _ in df.columns)
+    conn.executemany(
+        f'INSERT INTO "{table_name}" ({column_list}) VALUES ({placeholders})',
+        _sql_rows(df)
+    )
+
+
+def apply_row_changes(conn, table_name, upserts, deleted_ids):
+    """Apply keyed inserts/updates and deletes to a table inside the caller's transaction"""
+    columns = list(upserts.columns)
+    column_list = ', '.join(f'"{col}"' for col in columns)
+    placeholders = ', '.join('?' for _ in columns)
+    assignments = ', '.join(f'"{col}" = excluded."{col}"' for col in columns if col != 'id')
+    upsert_sql = (
+        f'INSERT INTO "{table_name}" ({column_list}) VALUES ({placeholders}) '
+        f'ON CONFLICT (id) DO UPDATE SET {assignments}'
+    )
+
+    conn.executemany(
+        f'DELETE FROM "{table_name}" WHERE id = ?',
+        ((int(i),) for i in deleted_ids)
+    )
+    if len(upserts):
+        conn.executemany(upsert_sql, _sql_rows(upserts))
+
+
+@instrument
+def save_data_to_db(df):
+    """Save dataframe to SQLite database preserving original data types
+
+    Only rows that differ from the stored table, matched on id, are written.
+    """
+    column_types = get_column_types()
+    df = coerce_to_column_types(df, column_types)
+
+    # New rows without an id get the next free ones
+    if 'id' in df.columns and df['id'].isna().any():
+        stored_max = get_connection().execute('SELECT COALESCE(MAX(id), 0) FROM sales_data').fetchone()[0]
+        next_id = max(stored_max, int(df['id'].max() if df['id'].notna().any() else 0)) + 1
+        missing = df['id'].isna()
+        df.loc[missing, 'id'] = range(next_id, next_id + int(missing.sum()))
+
+    with transaction() as conn:
+        keyed = (
+            'id' in df.columns
+            and set(df.columns) == set(column_types)
+            and not df['id'].duplicated().any()
+            and ensure_id_index(conn, 'sales_data')
+        )
+        if keyed:
+            upserts, deleted_ids = diff_frames(read_data_from_db(), df)
+            apply_row_changes(conn, 'sales_data', upserts, deleted_ids)
+        else:
+            # The columns changed or ids are unusable, so the table is rewritten
+            replace_table(conn, 'sales_data', df)
+            ensure_id_index(conn, 'sales_data')
+            rebuild_summary_tables(conn)
+        bump_table_revision(conn, 'sales_data')
+    bump_write_counter()
     print("Data saved to database successfully!")
 
 
+@instrument
+def save_changes_to_db(updated, deleted_ids, table_name='sales_data', progress=None):
+    """Apply a changeset of edited cells ({id: {column: value}}) and deleted row ids
+
+    progress, if given, is called with (steps done, total steps) as the write proceeds.
+    """
+    column_types = get_column_types(table_name)
+
+    # Group the edited cells by column so each column is one executemany
+    cells = {}
+    for row_id, changes in updated.items():
+        for col, value in changes.items():
+            if col in column_types and col != 'id':
+                cells.setdefault(col, []).append((int(row_id), value))
+
+    # One step for the deletes and one per edited column
+    total_steps = 1 + len(cells)
+    with transaction() as conn:
+        conn.executemany(
+            f'DELETE FROM "{table_name}" WHERE id = ?',
+            ((int(i),) for i in deleted_ids)
+        )
+        if progress:
+            progress(1, total_steps)
+        for step, (col, edits) in enumerate(cells.items(), start=2):
+            ids, values = zip(*edits)
+            coerced = coerce_to_column_types(pd.DataFrame({col: list(values)}), {col: column_types[col]})
+            # A cleared cell is written as NULL, whatever its coerced value
+            conn.executemany(
+                f'UPDATE "{table_name}" SET "{col}" = ? WHERE id = ?',
+                (
+                    (None if raw is None else value, row_id)
+                    for raw, (value,), row_id in zip(values, _sql_rows(coerced), ids)
+                )
+            )
+            if progress:
+                progress(step, total_steps)
+        bump_table_revision(conn, table_name)
+    bump_write_counter()
+    print("Changes saved to database successfully!")
+
+
+@instrument
+def replace_table_from_batches(table_name, batches, progress=None):
+    """Replace a table's rows with a stream of DataFrame batches, in one transaction
+
+    Batches are coerced to the table's column types like save_data_to_db does;
+    missing columns are stored as null and missing ids numbered after the
+    largest one, once every batch is in. geo_data geometries are WKB and go
+    into its R*Tree too. A repeated id raises ValueError and nothing is
+    replaced. progress, if given, is called with the number of rows written
+    after each batch.
+    """
+    column_types = get_column_types(table_name)
+    columns = list(column_types)
+    conn = get_connection()
+    create_sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone()[0]
+    coerced_types = {col: dtype for col, dtype in column_types.items() if col != 'geometry'}
+    column_list = ', '.join(f'"{col}"' for col in columns)
+    placeholders = ', '.join('?' for _ in columns)
+    indexed = table_name == 'geo_data'
+
+    keyed = 'id' in columns
+    rows = 0
+    with transaction() as conn:
+        # Recreated empty, which also drops its triggers until the end; readers
+        # keep seeing the old rows until the commit
+        conn.execute(f'DROP TABLE "{table_name}"')
+        conn.execute(create_sql)
+        # Indexed from the start, so a repeated id fails as soon as it is inserted
+        if keyed:
+            ensure_id_index(conn, table_name)
+        if indexed:
+            rebuild_geo_index(conn, [], [])
+
+        for batch in batches:
+            batch = coerce_to_column_types(batch.reindex(columns=columns), coerced_types)
+            try:
+                conn.executemany(
+                    f'INSERT INTO "{table_name}" ({column_list}) VALUES ({placeholders})', _sql_rows(batch)
+                )
+            except sqlite3.IntegrityError as e:
+                raise ValueError(f"Rows {rows + 1:,} to {rows + len(batch):,} repeat an id already used: {e}") from e
+            if indexed:
+                # Rows without an id are indexed once they are numbered
+                numbered = batch['id'].notna()
+                add_to_geo_index(conn, batch.loc[numbered, 'id'], shapely.from_wkb(batch.loc[numbered, 'geometry']))
+            rows += len(batch)
+            if progress:
+                progress(rows)
+
+        if keyed:
+            # Numbered after the largest id of the whole upload, which only
+            # the rows numbered here can exceed
+            largest = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM "{table_name}"').fetchone()[0]
+            conn.execute(f'UPDATE "{table_name}" SET id = ? + rowid WHERE id IS NULL', (largest,))
+            if indexed:
+                numbered = conn.execute(
+                    f'SELECT id, geometry FROM "{table_name}" WHERE id > ?', (largest,)
+                ).fetchall()
+                if numbered:
+                    ids, geometries = zip(*numbered)
+                    add_to_geo_index(conn, ids, shapely.from_wkb(list(geometries)))
+            if not ensure_id_index(conn, table_name):
+                raise ValueError(f"The ids of the rows for {table_name} aren't unique")
+        if table_name == 'sales_data':
+            rebuild_summary_tables(conn)
+        bump_table_revision(conn, table_name)
+    bump_write_counter()
+    print(f"Replaced {table_name} with {rows:,} rows")
+    return rows
+
+
 def create_sample_geo_database():
     """Create a sample geospatial database with polygon data"""
-    conn = sqlite3.connect('sample_data.db')
-    
     # Create sample GeoJSON polygons (simplified city boundaries)
     geo_data = {
         'id': [1, 2, 3, 4, 5],
         'name': ['Downtown', 'Riverside', 'Hillside', 'Lakefront', 'Industrial'],
         'population': [45000, 32000, 28000, 51000, 15000],
         'area_km2': [12.5, 18.3, 22.1, 15.7, 25.4],
-        'geojson': [
-            json.dumps({"type": "Polygon", "coordinates": [[[-74.01, 40.71], [-74.00, 40.71], [-74.00, 40.72], [-74.01, 40.72], [-74.01, 40.71]]]}),
-            json.dumps({"type": "Polygon", "coordinates": [[[-74.02, 40.71], [-74.01, 40.71], [-74.01, 40.72], [-74.02, 40.72], [-74.02, 40.71]]]}),
-            json.dumps({"type": "Polygon", "coordinates": [[[-74.00, 40.72], [-73.99, 40.72], [-73.99, 40.73], [-74.00, 40.73], [-74.00, 40.72]]]}),
-            json.dumps({"type": "Polygon", "coordinates": [[[-74.01, 40.72], [-74.00, 40.72], [-74.00, 40.73], [-74.01, 40.73], [-74.01, 40.72]]]}),
-            json.dumps({"type": "Polygon", "coordinates": [[[-74.02, 40.72], [-74.01, 40.72], [-74.01, 40.73], [-74.02, 40.73], [-74.02, 40.72]]]}),
-        ]
     }
+    polygons = [
+        {"type": "Polygon", "coordinates": [[[-74.01, 40.71], [-74.00, 40.71], [-74.00, 40.72], [-74.01, 40.72], [-74.01, 40.71]]]},
+        {"type": "Polygon", "coordinates": [[[-74.02, 40.71], [-74.01, 40.71], [-74.01, 40.72], [-74.02, 40.72], [-74.02, 40.71]]]},
+        {"type": "Polygon", "coordinates": [[[-74.00, 40.72], [-73.99, 40.72], [-73.99, 40.73], [-74.00, 40.73], [-74.00, 40.72]]]},
+        {"type": "Polygon", "coordinates": [[[-74.01, 40.72], [-74.00, 40.72], [-74.00, 40.73], [-74.01, 40.73], [-74.01, 40.72]]]},
+        {"type": "Polygon", "coordinates": [[[-74.02, 40.72], [-74.01, 40.72], [-74.01, 40.73], [-74.02, 40.73], [-74.02, 40.72]]]},
+    ]
     
+    # Geometries are stored as WKB, which is compact and parses without JSON decoding
     df = pd.DataFrame(geo_data)
-    df.to_sql('geo_data', conn, if_exists='replace', index=False)
-    conn.close()
+    geometries = np.array([shape(p) for p in polygons])
+    df['geometry'] = shapely.to_wkb(geometries)
+    with transaction() as conn:
+        replace_table(conn, 'geo_data', df, dtype={'geometry': 'BLOB'})
+        rebuild_geo_index(conn, df['id'], geometries)
+        bump_table_revision(conn, 'geo_data')
+    bump_write_counter()
     print("Sample geo database created successfully!")
 
 
+def create_sample_layer_tables():
+    """Create sample zone polygons and points of interest for the extra map layers"""
+    zones = pd.DataFrame({
+        'id': [1, 2, 3],
+        'name': ['Financial District', 'Waterfront', 'Uptown'],
+        'zone_type': ['Commercial', 'Mixed use', 'Residential'],
+    })
+    zone_polygons = [
+        {"type": "Polygon", "coordinates": [[[-74.025, 40.705], [-74.005, 40.705], [-74.005, 40.718], [-74.025, 40.718], [-74.025, 40.705]]]},
+        {"type": "Polygon", "coordinates": [[[-74.005, 40.705], [-73.985, 40.705], [-73.985, 40.718], [-74.005, 40.718], [-74.005, 40.705]]]},
+        {"type": "Polygon", "coordinates": [[[-74.025, 40.718], [-73.985, 40.718], [-73.985, 40.735], [-74.025, 40.735], [-74.025, 40.718]]]},
+    ]
+    zones['geometry'] = shapely.to_wkb(np.array([shape(p) for p in zone_polygons]))
+
+    pois = pd.DataFrame({
+        'id': range(1, 9),
+        'name': ['City Hall', 'Central Library', 'River Park', 'Museum of Art',
+                 'Main Station', 'General Hospital', 'Market Hall', 'Stadium'],
+        'category': ['Government', 'Education', 'Park', 'Culture',
+                     'Transport', 'Health', 'Shopping', 'Sport'],
+        'lon': [-74.006, -74.013, -74.018, -73.995, -74.003, -73.992, -74.009, -74.015],
+        'lat': [40.713, 40.716, 40.709, 40.726, 40.722, 40.715, 40.729, 40.731],
+    })
+
+    with transaction() as conn:
+        replace_table(conn, 'zone_data', zones, dtype={'geometry': 'BLOB'})
+        bump_table_revision(conn, 'zone_data')
+        replace_table(conn, 'poi_data', pois)
+        bump_table_revision(conn, 'poi_data')
+    bump_write_counter()
+    print("Sample map layer tables created successfully!")
+
+
+def table_exists(table_name):
+    """Check whether a table exists in the database"""
+    return get_connection().execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone() is not None
+
+
+def seed_missing_tables():
+    """Create the sample tables that don't exist yet, leaving existing data alone"""
+    seeded = []
+    if not table_exists('sales_data'):
+        create_sample_database()
+        seeded.append('sales_data')
+    if not table_exists('geo_data'):
+        create_sample_geo_database()
+        seeded.append('geo_data')
+    if not (table_exists('zone_data') and table_exists('poi_data')):
+        create_sample_layer_tables()
+        seeded += ['zone_data', 'poi_data']
+    return seeded
+
+
+@instrument
 def read_geo_data_from_db():
-    """Read geospatial data from SQLite database"""
-    conn = sqlite3.connect('sample_data.db')
-    query = "SELECT * FROM geo_data"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
+    """Read geospatial data from SQLite database as a GeoDataFrame
+
+    Results are cached per database version; treat the returned frame as read-only.
+    """
+    return data_cache.get_or_load('geo_data', get_data_version(), _read_geo_data_from_db)
+
+
+def _read_geo_data_from_db():
+    return _to_geodataframe(get_storage().read('geo_data'))
+
+
+def _to_geodataframe(df):
+    """Parse the stored geometry column of a geo_data query result"""
+    # geopandas is slow to import and only the map needs it
+    import geopandas as gpd
+
+    if 'geometry' in df.columns:
+        geometry = gpd.GeoSeries.from_wkb(df.pop('geometry'), crs='EPSG:4326')
+    else:
+        # Tables written before geometries were stored as WKB
+        geometry = gpd.GeoSeries(shapely.from_geojson(df.pop('geojson')), crs='EPSG:4326')
+    return gpd.GeoDataFrame(df, geometry=geometry)
+
+
+@instrument
+def get_geo_features():
+    """Get the GeoJSON features of geo_data, built once per database version
+
+    Returns {'collection': FeatureCollection, 'by_id': {id: feature}}. Features
+    only carry their id; attributes are looked up from read_geo_data_from_db().
+    """
+    return data_cache.get_or_load(
+        'geo_features', get_data_version(), _build_geo_features, sizeof=_geo_features_size
+    )
+
+
+def _build_geo_features():
+    gdf = read_geo_data_from_db()
+    collection = to_feature_collection(gdf)
+    return {
+        'collection': collection,
+        'by_id': {feature['properties']['id']: feature for feature in collection['features']},
+        'num_coordinates': int(shapely.get_num_coordinates(gdf.geometry.values).sum()),
+    }
+
+
+def _geo_features_size(features):
+    # Roughly what a coordinate pair costs as nested Python lists of floats
+    return features['num_coordinates'] * 120
+
+
+def to_feature_collection(gdf):
+    """Build a GeoJSON FeatureCollection whose features carry only their id"""
+    # Coordinates are rounded to config.GEOJSON_PRECISION decimals, digits past
+    # that only make the payload larger
+    geometries = shapely.set_precision(
+        gdf.geometry.values, 10 ** -config.GEOJSON_PRECISION, mode='pointwise'
+    )
+    features = [
+        {
+            "type": "Feature",
+            "id": str(feature_id),
+            "geometry": geometry,
+            "properties": {"id": feature_id},
+        }
+        for feature_id, geometry in zip(
+            gdf['id'].tolist(),
+            (None if g is None else json.loads(g) for g in shapely.to_geojson(geometries))
+        )
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def rebuild_geo_index(conn, ids, geometries):
+    """Recreate the R*Tree of feature bounding boxes inside the caller's transaction"""
+    conn.execute('DROP TABLE IF EXISTS geo_data_rtree')
+    conn.execute('CREATE VIRTUAL TABLE geo_data_rtree USING rtree(id, minx, maxx, miny, maxy)')
+    add_to_geo_index(conn, ids, geometries)
+
+
+def add_to_geo_index(conn, ids, geometries):
+    """Add the bounding boxes of features to the R*Tree inside the caller's transaction
+
+    Features without a geometry, or with an empty one, have no bounds and are left out.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    bounded = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+    ids = np.asarray(ids, dtype=object)[bounded]
+    bounds = shapely.bounds(geometries[bounded]).reshape(-1, 4)
+    conn.executemany(
+        'INSERT INTO geo_data_rtree (id, minx, maxx, miny, maxy) VALUES (?, ?, ?, ?, ?)',
+        zip(
+            (int(i) for i in ids),
+            bounds[:, 0].tolist(), bounds[:, 2].tolist(),
+            bounds[:, 1].tolist(), bounds[:, 3].tolist()
+        )
+    )
+
+
+def ensure_geo_index():
+    """Build the geo_data R*Tree if it is missing or out of step with the table"""
+    return data_cache.get_or_load('geo_index', get_data_version(), _ensure_geo_index)
+
+
+def _ensure_geo_index():
+    conn = get_connection()
+    try:
+        indexed, total = conn.execute(
+            'SELECT (SELECT COUNT(*) FROM geo_data_rtree), (SELECT COUNT(*) FROM geo_data)'
+        ).fetchone()
+        if indexed == total:
+            return True
+    except sqlite3.OperationalError:
+        pass  # No index yet
+
+    gdf = read_geo_data_from_db()
+    with transaction() as conn:
+        rebuild_geo_index(conn, gdf['id'], gdf.geometry.values)
+    return True
+
+
+@instrument
+def count_geo_features():
+    """Count the rows of geo_data"""
+    return data_cache.get_or_load(
+        'geo_count', get_data_version(),
+        lambda: get_connection().execute('SELECT COUNT(*) FROM geo_data').fetchone()[0]
+    )
+
+
+@instrument
+def read_geo_data_in_bbox(minx, miny, maxx, maxy, limit=None):
+    """Read the features intersecting a lon/lat bounding box, largest first when limited"""
+    storage = get_storage()
+    if storage.name == 'sqlite':
+        ensure_geo_index()
+    gdf = _to_geodataframe(storage.read_in_bbox('geo_data', minx, miny, maxx, maxy, limit=limit))
+
+    # The index only compares bounding boxes
+    return gdf[gdf.intersects(shapely.box(minx, miny, maxx, maxy))].reset_index(drop=True)
+
 
+@instrument
+def read_geo_data_by_ids(ids):
+    """Read the given features of geo_data"""
+    ids = [int(i) for i in ids]
+    return _to_geodataframe(get_storage().read('geo_data', filters=[('id', 'in', ids)]))
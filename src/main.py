@@ -1,14 +1,18 @@
 from dash import Dash, html, dcc, page_container
-from src.lib import create_sample_database, create_sample_geo_database
+from src.lib import seed_missing_tables
+from src.export import register_export_routes
+from src.ingest import register_upload_routes
+from src.metrics import register_metrics_routes
+from src.serialization import register_compression
+from src.tiles import register_tile_routes
 
 
-def main():
-    # Create sample databases
-    create_sample_database()
-    create_sample_geo_database()
-    
+def create_app():
+    """Create the Dash app with its pages and extra server routes"""
     # Initialize the Dash app with multi-page support
-    app = Dash(__name__, use_pages=True)
+    # Without suppress_callback_exceptions Dash renders every page's layout,
+    # data included, into the index HTML to validate callbacks against
+    app = Dash(__name__, use_pages=True, suppress_callback_exceptions=True)
     
     # Create the app layout with navigation
     app.layout = html.Div([
@@ -48,6 +52,15 @@ def main():
                     'borderRadius': '5px',
                     'display': 'inline-block'
                 }),
+                dcc.Link('Upload', href='/upload', style={
+                    'padding': '10px 20px',
+                    'margin': '0 10px',
+                    'textDecoration': 'none',
+                    'backgroundColor': '#8e44ad',
+                    'color': 'white',
+                    'borderRadius': '5px',
+                    'display': 'inline-block'
+                }),
             ], style={
                 'textAlign': 'center',
                 'margin': '20px',
@@ -62,6 +75,27 @@ def main():
         # Page content will be rendered here
         page_container
     ])
+
+    # Gzip/brotli responses; registered first so it runs after the other
+    # after_request handlers, which then see uncompressed sizes
+    register_compression(app.server)
+    # Vector tiles for the map page
+    register_tile_routes(app.server)
+    # Streaming table exports
+    register_export_routes(app.server)
+    # Resumable uploads for the upload page
+    register_upload_routes(app.server)
+    # Callback timings and data function metrics on /metrics
+    register_metrics_routes(app.server)
+
+    return app
+
+
+def main():
+    # Create the sample tables on first run, keeping existing data
+    seed_missing_tables()
+
+    app = create_app()
     
     # Run the app
     print("Starting Dash multi-page app...")
@@ -0,0 +1,195 @@
+# Latency, row count and payload size metrics, served in Prometheus text format
+#
+# Metrics are kept per process; with several workers each one reports its own.
+import cProfile
+import functools
+import os
+import threading
+import time
+import flask
+import pandas as pd
+from src import config
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the payload size histogram buckets, in bytes
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Dash sends every callback through this route
+CALLBACK_ROUTE = '/_dash-update-component'
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket bounds"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """Histograms and counters keyed by metric name and label values"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, name, kind, help_text, labels, factory):
+        metric = self._metrics.setdefault(name, {'kind': kind, 'help': help_text, 'series': {}})
+        key = tuple(sorted(labels.items()))
+        if key not in metric['series']:
+            metric['series'][key] = factory()
+        return metric['series'], key
+
+    def observe(self, name, help_text, value, buckets=LATENCY_BUCKETS, **labels):
+        with self._lock:
+            series, key = self._get(name, 'histogram', help_text, labels, lambda: Histogram(buckets))
+            series[key].observe(value)
+
+    def inc(self, name, help_text, value=1, **labels):
+        with self._lock:
+            series, key = self._get(name, 'counter', help_text, labels, lambda: 0)
+            series[key] += value
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._metrics.items()):
+                lines.append(f"# HELP {name} {metric['help']}")
+                lines.append(f"# TYPE {name} {metric['kind']}")
+                for key, value in sorted(metric['series'].items()):
+                    labels = dict(key)
+                    if metric['kind'] == 'counter':
+                        lines.append(f"{name}{_format_labels(labels)} {value}")
+                        continue
+                    for bound, count in zip(value.buckets, value.counts):
+                        lines.append(f"{name}_bucket{_format_labels(labels, le=repr(float(bound)))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, le='+Inf')} {value.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {value.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def count_rows(result):
+    """Rows in a data function result, or None when it isn't row-shaped"""
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result)
+    # (frame, total) pairs such as read_page_from_db
+    if isinstance(result, tuple) and result and isinstance(result[0], pd.DataFrame):
+        return len(result[0])
+    if isinstance(result, dict) and 'collection' in result:
+        return len(result['collection']['features'])
+    return None
+
+
+def instrument(func):
+    """Record the latency, errors and returned rows of a data function
+
+    Only entry points are instrumented, not the loaders they call on a cache
+    miss, so each row is counted once.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            registry.inc('dash_data_errors_total', "Data function calls that raised", function=name)
+            raise
+        finally:
+            registry.observe(
+                'dash_data_duration_seconds', "Time spent in data functions, including cache hits",
+                time.perf_counter() - start, function=name
+            )
+        rows = count_rows(result)
+        if rows is not None:
+            registry.inc('dash_data_rows_total', "Rows returned by data functions", rows, function=name)
+        return result
+
+    return wrapper
+
+
+def _callback_name():
+    """Outputs of the callback being requested, which is how Dash identifies it"""
+    body = flask.request.get_json(silent=True) or {}
+    return body.get('output', 'unknown')
+
+
+def register_metrics_routes(server):
+    """Time Dash callback requests and serve every metric on /metrics"""
+
+    @server.before_request
+    def start_callback_timer():
+        if flask.request.path.endswith(CALLBACK_ROUTE):
+            flask.g.metrics_start = time.perf_counter()
+            if config.PROFILE_DIR:
+                flask.g.profiler = cProfile.Profile()
+                flask.g.profiler.enable()
+
+    @server.after_request
+    def record_callback(response):
+        start = flask.g.pop('metrics_start', None)
+        if start is None:
+            return response
+        profiler = flask.g.pop('profiler', None)
+        if profiler:
+            profiler.disable()
+
+        callback = _callback_name()
+        elapsed = time.perf_counter() - start
+        registry.observe(
+            'dash_callback_duration_seconds', "Time to run a callback and serialize its response",
+            elapsed, callback=callback
+        )
+        if not response.is_streamed:
+            registry.observe(
+                'dash_callback_response_bytes', "Serialized callback response size",
+                len(response.get_data()), buckets=SIZE_BUCKETS, callback=callback
+            )
+        if response.status_code >= 400:
+            registry.inc('dash_callback_errors_total', "Callback requests that failed", callback=callback)
+        if profiler:
+            _write_profile(profiler, callback)
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return flask.Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _write_profile(profiler, callback):
+    """Save a callback request's profile for e.g. snakeviz or pstats"""
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in callback).strip('_')[:100]
+    path = os.path.join(config.PROFILE_DIR, f'{time.time():.6f}-{os.getpid()}-{safe_name}.prof')
+    profiler.dump_stats(path)
@@ -1,64 +1,209 @@
+import hashlib
+import json
+import time
 import pandas as pd
-from dash import html, dcc, dash_table, register_page, callback, Input, Output
-import plotly.express as px
-from src.lib import read_data_from_db
+from dash import (
+    html, dcc, dash_table, register_page, callback, clientside_callback, no_update, ClientsideFunction,
+    Patch, Input, Output, State
+)
+from src import config
+from src.export import export_links
+from src.lib import get_table_columns, get_table_revision, read_page_from_db, read_sales_cube, slice_sales_cube
+from src.metrics import registry
+from src.serialization import to_columnar
+
+# Number of rows fetched from the database per table page
+PAGE_SIZE = 10
 
 # Register this page with Dash
 register_page(__name__, path='/', name='Single DataFrame')
 
+def dashboard_summary(filters=None):
+    """Statistics and chart totals of the sales matching the cross-filters, sliced from the aggregate cube"""
+    return dict(slice_sales_cube(read_sales_cube(), filters), filters=filters or {})
+
+
+def statistics_children(summary):
+    """Contents of the statistics panel"""
+    filters = {dim: value for dim, value in summary['filters'].items() if value is not None}
+    return [
+        html.H4("Database Statistics"),
+        html.P(f"Total Records: {summary['total_records']}"),
+        html.P(f"Total Sales: ${summary['total_sales']:,.2f}"),
+        html.P(f"Average Sales: ${summary['average_sales']:,.2f}"),
+    ] + ([
+        html.P("Filtered by " + ", ".join(f"{dim} {value}" for dim, value in filters.items()),
+               style={'color': '#666'})
+    ] if filters else [])
+
+
+def _opacities(labels, selected):
+    # The selected bar stands out, all are solid when none is
+    return [1.0 if selected is None or label == selected else 0.3 for label in labels]
+
+
+def _pulls(labels, selected):
+    return [0.1 if label == selected else 0 for label in labels]
+
+
+def product_figure(summary):
+    """Bar chart of the sales by product"""
+    # Deferred, plotly.express is slow to import
+    import plotly.express as px
+
+    fig = px.bar(
+        summary['by_product'],
+        x='product',
+        y='sales',
+        title='Total Sales by Product',
+        color='sales',
+        color_continuous_scale='Viridis'
+    )
+    return fig.update_traces(marker_opacity=_opacities(summary['by_product']['product'], summary['filters'].get('product')))
+
+
+def region_figure(summary):
+    """Pie chart of the sales by region"""
+    import plotly.express as px
+
+    fig = px.pie(
+        summary['by_region'],
+        values='sales',
+        names='region',
+        title='Sales Distribution by Region'
+    )
+    return fig.update_traces(pull=_pulls(summary['by_region']['region'], summary['filters'].get('region')))
+
+
+def quarter_figure(summary):
+    """Bar chart of the sales by quarter"""
+    import plotly.express as px
+
+    fig = px.bar(
+        summary['by_quarter'],
+        x='quarter',
+        y='sales',
+        title='Total Sales by Quarter'
+    )
+    return fig.update_traces(marker_opacity=_opacities(summary['by_quarter']['quarter'], summary['filters'].get('quarter')))
+
+
+def chart_patch(dim, summary):
+    """Update of a chart's values and selection, leaving the rest of its figure as the browser has it"""
+    frame = summary[f'by_{dim}']
+    labels, values = frame[dim].tolist(), frame['sales'].tolist()
+    selected = summary['filters'].get(dim)
+    patched = Patch()
+    if dim == 'region':
+        patched['data'][0]['labels'] = labels
+        patched['data'][0]['values'] = values
+        patched['data'][0]['pull'] = _pulls(labels, selected)
+    else:
+        patched['data'][0]['x'] = labels
+        patched['data'][0]['y'] = values
+        patched['data'][0]['marker']['opacity'] = _opacities(labels, selected)
+        if dim == 'product':
+            patched['data'][0]['marker']['color'] = values
+    return patched
 
-def create_dashboard_content(df):
-    """Create the dashboard content from a dataframe"""
+
+# Parts of the summary each dashboard panel is drawn from
+PANEL_INPUTS = {
+    'statistics': lambda summary: [
+        summary['total_records'], summary['total_sales'], summary['average_sales'], summary['filters']
+    ],
+    'by_product': lambda summary: [summary['by_product'].to_dict('list'), summary['filters'].get('product')],
+    'by_region': lambda summary: [summary['by_region'].to_dict('list'), summary['filters'].get('region')],
+    'by_quarter': lambda summary: [summary['by_quarter'].to_dict('list'), summary['filters'].get('quarter')],
+}
+
+
+def dashboard_version(revision, summary):
+    """What the browser has rendered: the table revision and a hash of each panel's inputs"""
+    return {
+        'revision': revision,
+        'panels': {
+            name: hashlib.sha1(json.dumps(inputs(summary), default=str).encode()).hexdigest()
+            for name, inputs in PANEL_INPUTS.items()
+        },
+    }
+
+
+def update_panels(rendered, filters):
+    """Updates of the panels whose inputs differ from what the browser has rendered, and the new version"""
+    revision = get_table_revision('sales_data')
+    summary = dashboard_summary(filters)
+    version = dashboard_version(revision, summary)
+    previous = (rendered or {}).get('panels', {})
+
+    def changed(name):
+        return version['panels'][name] != previous.get(name)
+
+    return (
+        statistics_children(summary) if changed('statistics') else no_update,
+        *(chart_patch(dim, summary) if changed(f'by_{dim}') else no_update for dim in ['product', 'region', 'quarter']),
+        version,
+    )
+
+
+def panel_container(component, style=None):
+    """A panel's component with the time its data took, shown with a spinner while it is first computed"""
+    return html.Div([
+        # Quick updates such as cross-filtering don't flash the spinner
+        dcc.Loading(component, delay_show=300),
+        html.Small(id=f'{component.id}-timing', style={'color': '#999'}),
+    ], style=style)
+
+
+def table_columns(columns):
+    """DataTable columns of the table's columns"""
+    return [{"name": i, "id": i} for i in columns]
+
+
+def create_dashboard_content(columns):
+    """Create the dashboard's panels, each filled in by its own callback"""
     return [
         # Statistics section
-        html.Div([
-            html.H4("Database Statistics"),
-            html.P(f"Total Records: {len(df)}"),
-            html.P(f"Total Sales: ${df['sales'].sum():,.2f}"),
-            html.P(f"Average Sales: ${df['sales'].mean():,.2f}"),
-        ], style={'margin': '20px'}),
+        panel_container(html.Div(id='database-statistics', children=[html.H4("Database Statistics")]), {'margin': '20px'}),
         
-        # Charts section
+        # Charts section, clicking a bar or slice filters the other panels by it
         html.Div([
             html.Div([
                 html.H4("Sales by Product"),
-                dcc.Graph(
-                    id='sales-by-product',
-                    figure=px.bar(
-                        df.groupby('product')['sales'].sum().reset_index(),
-                        x='product',
-                        y='sales',
-                        title='Total Sales by Product',
-                        color='sales',
-                        color_continuous_scale='Viridis'
-                    )
-                )
+                panel_container(dcc.Graph(id='sales-by-product'))
             ], style={'width': '48%', 'display': 'inline-block'}),
             
             html.Div([
                 html.H4("Sales by Region"),
-                dcc.Graph(
-                    id='sales-by-region',
-                    figure=px.pie(
-                        df.groupby('region')['sales'].sum().reset_index(),
-                        values='sales',
-                        names='region',
-                        title='Sales Distribution by Region'
-                    )
-                )
-            ], style={'width': '48%', 'display': 'inline-block', 'float': 'right'})
+                panel_container(dcc.Graph(id='sales-by-region'))
+            ], style={'width': '48%', 'display': 'inline-block', 'float': 'right'}),
+
+            html.Div([
+                html.H4("Sales by Quarter"),
+                panel_container(dcc.Graph(id='sales-by-quarter'))
+            ])
         ], style={'margin': '20px'}),
         
         # Data table section
         html.Div([
             html.H4("Data Table"),
+            # Exports are streamed by the server with the table's current filter and sort
+            html.Div(id='export-links', children=export_links('sales_data'), style={'marginBottom': '10px'}),
+            # The current page, sent column by column and expanded in the browser
+            dcc.Store(id='data-table-columnar'),
             dash_table.DataTable(
                 id='data-table',
-                columns=[{"name": i, "id": i} for i in df.columns],
-                data=df.to_dict('records'),
-                page_size=10,
-                export_format='xlsx',
-                export_headers='display',
+                columns=table_columns(columns),
+                data=[],
+                # Paging, sorting and filtering are done in SQL, one page at a time
+                page_current=0,
+                page_size=PAGE_SIZE,
+                page_action='custom',
+                sort_action='custom',
+                sort_mode='multi',
+                sort_by=[],
+                filter_action='custom',
+                filter_query='',
                 style_table={'overflowX': 'auto'},
                 style_cell={
                     'textAlign': 'left',
@@ -74,15 +219,20 @@ def create_dashboard_content(df):
                         'backgroundColor': 'rgb(248, 248, 248)'
                     }
                 ]
-            )
+            ),
+            html.Div(id='data-table-filter-error', style={'color': '#e74c3c'}),
+            html.Small(id='data-table-timing', style={'color': '#999'}),
         ], style={'margin': '20px'})
     ]
 
 
 # Define the layout for this page
 def layout():
-    # Read data from database
-    df = read_data_from_db()
+    # Only the page's frame and the table schema; each panel is computed by its
+    # own callback once the page is shown. The revision is read first, so a
+    # write in between is picked up by the next check
+    revision = get_table_revision('sales_data')
+    columns = get_table_columns('sales_data')
     
     return html.Div([
         html.Div([
@@ -99,21 +249,222 @@ def layout():
                 'margin': '20px',
                 'float': 'right'
             }),
+            # Live updates check for changes periodically and redraw only what changed
+            dcc.Checklist(
+                id='live-toggle',
+                options=[{'label': ' Live updates', 'value': 'live'}],
+                value=[],
+                style={'float': 'right', 'margin': '28px 0'}
+            ),
+            dcc.Interval(id='live-interval', interval=config.LIVE_UPDATE_SECONDS * 1000, disabled=True),
+            dcc.Store(id='dashboard-version', data=dashboard_version(revision, dashboard_summary())),
+            # The revision the table page was fetched at; unlike the version it
+            # doesn't move with the cross-filters, which the table ignores
+            dcc.Store(id='table-revision', data=revision),
+            # The value selected in each chart, {dimension: value}; kept across refreshes
+            dcc.Store(id='dashboard-filters', data={}),
+            html.Button('Clear filters', id='clear-filters-button', n_clicks=0, style={'float': 'right', 'margin': '28px 20px'}),
         ], style={'width': '100%', 'overflow': 'auto'}),
         
         html.Hr(),
         
         # Container for dynamic content
-        html.Div(id='dashboard-content', children=create_dashboard_content(df))
+        html.Div(id='dashboard-content', children=create_dashboard_content(columns))
     ])
 
 
+# Dashboard panels by name: the component each one draws into and how it is drawn from the summary
+PANELS = {
+    'statistics': (Output('database-statistics', 'children'), statistics_children),
+    'by_product': (Output('sales-by-product', 'figure'), product_figure),
+    'by_region': (Output('sales-by-region', 'figure'), region_figure),
+    'by_quarter': (Output('sales-by-quarter', 'figure'), quarter_figure),
+}
+
+
+def timing_text(seconds):
+    """How long a panel took, as shown under it"""
+    return f"Computed in {seconds * 1000:,.1f} ms"
+
+
+def observe_panel(name, seconds):
+    """Record how long a panel took to compute"""
+    registry.observe('dash_panel_duration_seconds', "Time to compute a dashboard panel", seconds, panel=name)
+
+
+def register_panel(name, output, draw):
+    """Register the callback that computes and draws one panel, on page load and on refresh
+
+    Each panel is a separate callback, so the browser requests them in
+    parallel and draws each one as soon as it is ready.
+    """
+    @callback(
+        output,
+        Output(f'{output.component_id}-timing', 'children'),
+        Input('refresh-button', 'n_clicks'),
+        State('dashboard-filters', 'data'),
+    )
+    def update_panel(n_clicks, filters):
+        start = time.perf_counter()
+        drawn = draw(dashboard_summary(filters))
+        elapsed = time.perf_counter() - start
+        observe_panel(name, elapsed)
+        return drawn, timing_text(elapsed)
+
+    return update_panel
+
+
+# The panel callbacks by panel name
+PANEL_CALLBACKS = {name: register_panel(name, output, draw) for name, (output, draw) in PANELS.items()}
+
+
 @callback(
-    Output('dashboard-content', 'children'),
+    Output('data-table', 'columns'),
+    Output('dashboard-version', 'data'),
     Input('refresh-button', 'n_clicks'),
+    State('dashboard-filters', 'data'),
     prevent_initial_call=True
 )
-def refresh_data(n_clicks):
-    """Refresh data from database when button is clicked"""
-    df = read_data_from_db()
-    return create_dashboard_content(df)
+def refresh_data(n_clicks, filters):
+    """Refresh the table's columns and the rendered version when the button is clicked
+
+    The panels refresh themselves from the same click; a new revision in the
+    version makes the table fetch its current page again.
+    """
+    revision = get_table_revision('sales_data')
+    return table_columns(get_table_columns('sales_data')), dashboard_version(revision, dashboard_summary(filters))
+
+
+clientside_callback(
+    """
+    function(value) {
+        return !(value && value.includes('live'));
+    }
+    """,
+    Output('live-interval', 'disabled'),
+    Input('live-toggle', 'value')
+)
+
+
+@callback(
+    Output('database-statistics', 'children', allow_duplicate=True),
+    Output('sales-by-product', 'figure', allow_duplicate=True),
+    Output('sales-by-region', 'figure', allow_duplicate=True),
+    Output('sales-by-quarter', 'figure', allow_duplicate=True),
+    Output('dashboard-version', 'data', allow_duplicate=True),
+    Input('live-interval', 'n_intervals'),
+    State('dashboard-version', 'data'),
+    State('dashboard-filters', 'data'),
+    prevent_initial_call=True
+)
+def live_update(n_intervals, rendered, filters):
+    """Redraw the panels whose inputs changed since the browser last rendered them"""
+    # The revision is shared by every worker and cached per data version, so an
+    # unchanged table costs a PRAGMA and a cache lookup
+    if rendered and rendered['revision'] == get_table_revision('sales_data'):
+        return no_update, no_update, no_update, no_update, no_update
+    return update_panels(rendered, filters)
+
+
+# Toggle a chart's filter when one of its bars or slices is clicked, in the browser
+clientside_callback(
+    """
+    function(productClick, regionClick, quarterClick, clearClicks, filters) {
+        const triggered = window.dash_clientside.callback_context.triggered.map(t => t.prop_id);
+        if (triggered.includes('clear-filters-button.n_clicks')) {
+            return {};
+        }
+        const clicks = {
+            'sales-by-product.clickData': ['product', productClick, 'x'],
+            'sales-by-region.clickData': ['region', regionClick, 'label'],
+            'sales-by-quarter.clickData': ['quarter', quarterClick, 'x'],
+        };
+        const updated = Object.assign({}, filters);
+        for (const id of triggered) {
+            const [dim, click, key] = clicks[id] || [];
+            if (!click || !click.points.length) continue;
+            const value = click.points[0][key];
+            updated[dim] = updated[dim] === value ? null : value;
+        }
+        return updated;
+    }
+    """,
+    Output('dashboard-filters', 'data'),
+    Input('sales-by-product', 'clickData'),
+    Input('sales-by-region', 'clickData'),
+    Input('sales-by-quarter', 'clickData'),
+    Input('clear-filters-button', 'n_clicks'),
+    State('dashboard-filters', 'data'),
+    prevent_initial_call=True
+)
+
+
+@callback(
+    Output('database-statistics', 'children', allow_duplicate=True),
+    Output('sales-by-product', 'figure', allow_duplicate=True),
+    Output('sales-by-region', 'figure', allow_duplicate=True),
+    Output('sales-by-quarter', 'figure', allow_duplicate=True),
+    Output('dashboard-version', 'data', allow_duplicate=True),
+    Input('dashboard-filters', 'data'),
+    State('dashboard-version', 'data'),
+    prevent_initial_call=True
+)
+def cross_filter(filters, rendered):
+    """Redraw the panels from the cube slice of the selected values, without querying the table"""
+    return update_panels(rendered, filters)
+
+
+# Follow the revision of the rendered version, in the browser, so a cross-filter
+# click doesn't fetch the same table page again
+clientside_callback(
+    """
+    function(version, revision) {
+        if (!version || version.revision === revision) {
+            return window.dash_clientside.no_update;
+        }
+        return version.revision;
+    }
+    """,
+    Output('table-revision', 'data'),
+    Input('dashboard-version', 'data'),
+    State('table-revision', 'data'),
+    prevent_initial_call=True
+)
+
+
+@callback(
+    Output('data-table-columnar', 'data'),
+    Output('data-table', 'page_count'),
+    Output('export-links', 'children'),
+    Output('data-table-timing', 'children'),
+    Output('data-table-filter-error', 'children'),
+    Input('data-table', 'page_current'),
+    Input('data-table', 'page_size'),
+    Input('data-table', 'sort_by'),
+    Input('data-table', 'filter_query'),
+    # Changes to the data show up on the current page too
+    Input('table-revision', 'data')
+)
+def update_table_page(page_current, page_size, sort_by, filter_query, revision=None):
+    """Fetch the requested page of the table from the database"""
+    start = time.perf_counter()
+    try:
+        page_df, total = read_page_from_db(page_current or 0, page_size, sort_by, filter_query)
+    except ValueError as e:
+        # An empty table rather than unfiltered rows that look filtered
+        empty = pd.DataFrame(columns=get_table_columns('sales_data'))
+        return to_columnar(empty), 1, export_links('sales_data'), no_update, f"✗ {e}"
+    page_count = max(1, -(-total // page_size))
+    elapsed = time.perf_counter() - start
+    observe_panel('table', elapsed)
+    return (
+        to_columnar(page_df), page_count, export_links('sales_data', filter_query, sort_by),
+        timing_text(elapsed), None
+    )
+
+
+clientside_callback(
+    ClientsideFunction('columnar', 'to_records'),
+    Output('data-table', 'data'),
+    Input('data-table-columnar', 'data')
+)
@@ -1,11 +1,20 @@
-import pandas as pd
-from dash import html, dash_table, register_page, callback, Input, Output, State
-from src.lib import read_data_from_db, save_data_to_db
+import json
+from dash import (
+    html, dcc, dash_table, register_page, clientside_callback, no_update, ClientsideFunction, Input, Output, State
+)
+from src.export import export_links
+from src.jobs import background_callback, run_deduplicated
+from src.lib import read_data_from_db, save_changes_to_db
+from src.serialization import to_columnar
 
 # Register this page with Dash
 register_page(__name__, path='/editor', name='Single Editor')
 
 
+# An empty changeset: edited cells keyed by row id, and deleted row ids
+NO_CHANGES = {'updated': {}, 'deleted': []}
+
+
 # Define the layout for this page
 def layout():
     # Read data from database
@@ -24,15 +33,18 @@ def layout():
         
         # Data table section
         html.Div([
+            # Exports stream the saved table from the server
+            html.Div(export_links('sales_data'), style={'marginBottom': '10px'}),
+            # Rows are sent column by column and expanded into the table in the browser
+            dcc.Store(id='editable-table-columnar', data=to_columnar(df)),
             dash_table.DataTable(
                 id='editable-table',
-                columns=[{"name": i, "id": i} for i in df.columns],
-                data=df.to_dict('records'),
+                # The id identifies rows in the changeset, so it can't be edited
+                columns=[{"name": i, "id": i, "editable": i != 'id'} for i in df.columns],
+                data=[],
                 page_size=15,
                 editable=True,
                 row_deletable=True,
-                export_format='xlsx',
-                export_headers='display',
                 style_table={'overflowX': 'auto'},
                 style_cell={
                     'textAlign': 'left',
@@ -51,6 +63,9 @@ def layout():
                     }
                 ]
             ),
+
+            # Edits made since the last save, tracked in the browser
+            dcc.Store(id='editor-changes', data=NO_CHANGES),
             
             # Save button and status message
             html.Div([
@@ -65,6 +80,11 @@ def layout():
                     'marginTop': '20px',
                     'marginRight': '10px'
                 }),
+                # Shown while a save runs in the background
+                html.Span([
+                    html.Progress(id='save-progress', value='0', max='1', style={'marginRight': '10px'}),
+                    html.Button('Cancel', id='cancel-save-button', n_clicks=0),
+                ], id='save-running', style={'display': 'none'}),
                 html.Div(id='save-status', style={
                     'display': 'inline-block',
                     'marginLeft': '20px',
@@ -76,22 +96,96 @@ def layout():
     ])
 
 
-@callback(
+clientside_callback(
+    ClientsideFunction('columnar', 'to_records'),
+    Output('editable-table', 'data'),
+    Input('editable-table-columnar', 'data')
+)
+
+
+# Record edited cells and deleted rows by comparing the table with its
+# previous state in the browser, so that saving only uploads the changes
+clientside_callback(
+    """
+    function(timestamp, data, previous, changes) {
+        if (!data || !previous) {
+            return window.dash_clientside.no_update;
+        }
+        const updated = Object.assign({}, changes.updated);
+        const deleted = changes.deleted.slice();
+
+        if (data.length < previous.length) {
+            const remaining = new Set(data.map(row => row.id));
+            previous.forEach(row => {
+                if (!remaining.has(row.id)) {
+                    deleted.push(row.id);
+                    delete updated[row.id];
+                }
+            });
+        } else {
+            data.forEach((row, i) => {
+                const old = previous[i];
+                // Rows the edit did not touch keep their identity
+                if (row === old || !old) {
+                    return;
+                }
+                Object.keys(row).forEach(col => {
+                    if (row[col] !== old[col]) {
+                        updated[row.id] = Object.assign({}, updated[row.id], {[col]: row[col]});
+                    }
+                });
+            });
+        }
+        return {updated: updated, deleted: deleted};
+    }
+    """,
+    Output('editor-changes', 'data'),
+    Input('editable-table', 'data_timestamp'),
+    State('editable-table', 'data'),
+    State('editable-table', 'data_previous'),
+    State('editor-changes', 'data'),
+    prevent_initial_call=True
+)
+
+
+@background_callback(
     Output('save-status', 'children'),
     Output('save-status', 'style'),
+    Output('editor-changes', 'data', allow_duplicate=True),
     Input('save-button', 'n_clicks'),
-    State('editable-table', 'data'),
+    State('editor-changes', 'data'),
+    running=[
+        (Output('save-button', 'disabled'), True, False),
+        (Output('save-running', 'style'), {'display': 'inline-block'}, {'display': 'none'}),
+        # The changeset is cleared once saved, so edits made meanwhile would be lost
+        (Output('editable-table', 'editable'), False, True),
+        (Output('editable-table', 'row_deletable'), False, True),
+    ],
+    progress=[Output('save-progress', 'value'), Output('save-progress', 'max')],
+    # Cancelling rolls the transaction back, nothing is saved
+    cancel=[Input('cancel-save-button', 'n_clicks')],
     prevent_initial_call=True
 )
-def save_changes(n_clicks, table_data):
-    """Save the edited table data to the database"""
+def save_changes(set_progress, n_clicks, changes):
+    """Save the edited cells and deleted rows to the database"""
     if n_clicks > 0:
+        changes = changes or NO_CHANGES
+        if not changes['updated'] and not changes['deleted']:
+            return "No changes to save", {
+                'display': 'inline-block',
+                'marginLeft': '20px',
+                'fontSize': '16px',
+                'fontWeight': 'bold',
+                'color': '#666'
+            }, no_update
+
         try:
-            # Convert table data to DataFrame
-            df = pd.DataFrame(table_data)
-            
-            # Save to database
-            save_data_to_db(df)
+            # Save only the changeset to the database; a double submit of the
+            # same changes while the first is running is applied once
+            run_deduplicated('save_changes', json.dumps(changes, sort_keys=True), lambda: save_changes_to_db(
+                changes['updated'], changes['deleted'],
+                progress=lambda done, total: set_progress((str(done), str(total)))
+            ))
             
             return "✓ Changes saved successfully!", {
                 'display': 'inline-block',
@@ -99,7 +193,7 @@ def save_changes(n_clicks, table_data):
                 'fontSize': '16px',
                 'fontWeight': 'bold',
                 'color': '#27ae60'
-            }
+            }, NO_CHANGES
         except Exception as e:
             return f"✗ Error saving: {str(e)}", {
                 'display': 'inline-block',
@@ -107,6 +201,6 @@ def save_changes(n_clicks, table_data):
                 'fontSize': '16px',
                 'fontWeight': 'bold',
                 'color': '#e74c3c'
-            }
+            }, no_update
     
-    return "", {'display': 'none'}
+    return "", {'display': 'none'}, no_update
@@ -1,69 +1,201 @@
-import pandas as pd
-import json
-from dash import html, dcc, dash_table, register_page, callback, Input, Output, callback_context
-import plotly.express as px
-from src.lib import read_geo_data_from_db
+import math
+import numpy as np
+from dash import (
+    html, dcc, dash_table, register_page, callback, clientside_callback, ctx, no_update, ClientsideFunction,
+    Input, Output, State, Patch, ALL
+)
+import plotly.graph_objects as go
+from src import config
+from src.export import export_links
+from src.layers import MAP_LAYERS, get_layer_trace, placeholder_trace
+from src.lib import (
+    count_geo_features, get_geo_features, read_geo_data_by_ids, read_geo_data_from_db,
+    read_geo_data_in_bbox, read_table, to_feature_collection
+)
+from src.serialization import to_columnar, typed_array
+from src.tiles import TILE_LAYER, tile_url_template
 
 # Register this page with Dash
 register_page(__name__, path='/map', name='Single Map')
 
 
-def create_map_figure(df, selected_ids=None):
-    """Create a Plotly map with GeoJSON polygons using Maplibre"""
-    # Add selection indicator column
-    df = df.copy()
-    df['selected'] = df['id'].apply(lambda x: 'Selected' if selected_ids and x in selected_ids else 'Not Selected')
-    
-    # Create GeoJSON FeatureCollection from the dataframe
-    features = []
-    for idx, row in df.iterrows():
-        geojson_geom = json.loads(row['geojson'])
-        feature = {
-            "type": "Feature",
-            "geometry": geojson_geom,
-            "id": str(row['id']),
-            "properties": {
-                "id": row['id'],
-                "name": row['name'],
-                "population": row['population'],
-                "area_km2": row['area_km2'],
-                "selected": row['selected']
-            }
-        }
-        features.append(feature)
-    
-    geojson_data = {
-        "type": "FeatureCollection",
-        "features": features
-    }
-    
-    # Create choropleth map with Maplibre
-    fig = px.choropleth_map(
-        df,
+# Hover text shared by the base and highlight traces, from customdata columns
+HOVER_COLUMNS = ['name', 'population', 'area_km2']
+HOVER_TEMPLATE = (
+    "<b>%{customdata[0]}</b><br>"
+    "Population: %{customdata[1]:,}<br>"
+    "Area (km²): %{customdata[2]:.1f}"
+    "<extra></extra>"
+)
+
+# Attribute columns listed in the table
+TABLE_COLUMNS = ['id', 'name', 'population', 'area_km2']
+
+# Trace order in the map figure, followed by one trace per layer of src/layers.py
+BASE_TRACE = 0
+HIGHLIGHT_TRACE = 1
+FIRST_LAYER_TRACE = 2
+
+# Initial map view
+MAP_CENTER = {"lat": 40.72, "lon": -74.01}
+MAP_ZOOM = 11
+# Map size in pixels assumed until the browser reports the visible area
+MAP_SIZE = (1200, 600)
+
+
+def _area_trace(df, geojson_data, name, color):
+    """Choropleth trace drawing the given areas in a single color"""
+    return go.Choroplethmap(
         geojson=geojson_data,
-        locations='id',
+        locations=df['id'].to_numpy(),
         featureidkey='properties.id',
-        color='selected',
-        color_discrete_map={'Selected': 'red', 'Not Selected': 'blue'},
-        hover_name='name',
-        hover_data={
-            'id': False,
-            'selected': False,
-            'population': ':,',
-            'area_km2': ':.1f'
-        },
-        labels={
-            'population': 'Population',
-            'area_km2': 'Area (km²)'
-        },
-        map_style='open-street-map',
-        center={"lat": 40.72, "lon": -74.01},
-        zoom=11,
-        opacity=0.5
+        z=np.zeros(len(df)),
+        colorscale=[[0, color], [1, color]],
+        showscale=False,
+        marker_opacity=0.5,
+        customdata=df[HOVER_COLUMNS].to_numpy(),
+        hovertemplate=HOVER_TEMPLATE,
+        name=name,
+        showlegend=True
+    )
+
+
+def _trace_update(gdf, geojson_data, value):
+    # Sent through Patch, which doesn't encode arrays as typed arrays by itself
+    return {
+        'geojson': geojson_data,
+        'locations': typed_array(gdf['id'].to_numpy()),
+        'z': typed_array(np.full(len(gdf), value)),
+        'customdata': gdf[HOVER_COLUMNS].to_numpy(),
+    }
+
+
+def highlight_trace_update(selected_ids=None):
+    """Properties of the highlight trace that draws only the selected areas"""
+    selected = read_geo_data_by_ids(selected_ids or [])
+    return _trace_update(selected, to_feature_collection(selected), 1)
+
+
+def base_trace_update(gdf, geojson_data=None):
+    """Properties of the base trace that draws the given areas"""
+    return _trace_update(gdf, geojson_data or to_feature_collection(gdf), 0)
+
+
+def visible_areas(bounds):
+    """Areas to draw for a lon/lat viewport as (GeoDataFrame, FeatureCollection)
+
+    Small tables are drawn whole from the cached collection; larger ones are
+    limited to config.MAP_MAX_FEATURES areas intersecting the viewport.
+    """
+    if count_geo_features() <= config.MAP_MAX_FEATURES:
+        return read_geo_data_from_db(), get_geo_features()['collection']
+    gdf = read_geo_data_in_bbox(*bounds, limit=config.MAP_MAX_FEATURES)
+    return gdf, to_feature_collection(gdf)
+
+
+def viewport_bounds(relayout_data=None):
+    """Lon/lat bounds (minx, miny, maxx, maxy) of the visible part of the map"""
+    relayout_data = relayout_data or {}
+    corners = relayout_data.get('map._derived', {}).get('coordinates')
+    if corners:
+        lons, lats = zip(*corners)
+        return min(lons), min(lats), max(lons), max(lats)
+
+    # Estimate from the center and zoom, in Web Mercator with MapLibre's 512px tiles
+    center = relayout_data.get('map.center', MAP_CENTER)
+    world_size = 512 * 2 ** relayout_data.get('map.zoom', MAP_ZOOM)
+    half_width = MAP_SIZE[0] / 2 / world_size
+    half_height = MAP_SIZE[1] / 2 / world_size
+    x = (center['lon'] + 180) / 360
+    y = (1 - math.asinh(math.tan(math.radians(center['lat']))) / math.pi) / 2
+
+    def to_lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+    return (
+        (x - half_width) * 360 - 180, to_lat(min(1, y + half_height)),
+        (x + half_width) * 360 - 180, to_lat(max(0, y - half_height))
     )
+
+
+def layer_trace_index(layer_id):
+    """Index in the map figure of a layer's trace"""
+    return FIRST_LAYER_TRACE + list(MAP_LAYERS).index(layer_id)
+
+
+def layer_traces():
+    """Traces of the extra layers: loaded for layers visible by default, placeholders otherwise"""
+    return [
+        get_layer_trace(layer_id) if layer['visible'] else placeholder_trace(layer_id)
+        for layer_id, layer in MAP_LAYERS.items()
+    ]
+
+
+def layer_controls():
+    """A visibility toggle and an opacity slider per layer"""
+    return [
+        html.Div([
+            dcc.Checklist(
+                id={'type': 'layer-visible', 'layer': layer_id},
+                options=[{'label': f" {layer['name']}", 'value': 'visible'}],
+                value=['visible'] if layer['visible'] else [],
+                style={'display': 'inline-block', 'width': '200px'}
+            ),
+            html.Div(dcc.Slider(
+                id={'type': 'layer-opacity', 'layer': layer_id},
+                min=0, max=1, step=0.1, value=layer['opacity'], marks=None,
+            ), style={'display': 'inline-block', 'width': '200px', 'verticalAlign': 'middle'}),
+        ])
+        for layer_id, layer in MAP_LAYERS.items()
+    ]
+
+
+def map_render_mode(feature_count):
+    """Pick how the areas are drawn, see config.MAP_RENDER_MODE"""
+    if config.MAP_RENDER_MODE == 'auto':
+        return 'tiles' if feature_count > config.MAP_TILE_THRESHOLD else 'geojson'
+    return config.MAP_RENDER_MODE
+
+
+def create_map_figure(df, selected_ids=None, mode=None, geojson_data=None):
+    """Create a Plotly map with GeoJSON polygons using Maplibre
+
+    Every area of df is drawn once in the base trace, from geojson_data or
+    else from the cached collection of all areas. Selected areas are drawn
+    again on top in a highlight trace, so a selection change only needs to
+    replace the highlight trace (see highlight_trace_update).
+
+    In 'tiles' mode the areas are drawn by a vector tile layer instead of
+    the base trace. Tiles don't emit hover or click events, so areas can
+    then only be selected from the table.
+    """
+    mode = mode or map_render_mode(count_geo_features())
+    layers = []
+    base = _area_trace(df.iloc[:0], None, 'Not Selected', 'blue')
+    if mode == 'tiles':
+        layers.append(dict(
+            sourcetype='vector',
+            source=[tile_url_template()],
+            sourcelayer=TILE_LAYER,
+            type='fill',
+            color='blue',
+            opacity=0.5
+        ))
+    else:
+        base.update(base_trace_update(df, geojson_data or get_geo_features()['collection']))
+    highlight = _area_trace(df.iloc[:0], None, 'Selected', 'red')
+    highlight.update(highlight_trace_update(selected_ids))
+
+    fig = go.Figure(data=[base, highlight] + layer_traces())
     
     # Update layout for Maplibre
     fig.update_layout(
+        map=dict(
+            style='open-street-map',
+            center=MAP_CENTER,
+            zoom=MAP_ZOOM,
+            layers=layers
+        ),
         height=600,
         margin=dict(l=0, r=0, t=0, b=0),
         uirevision='constant',  # Preserve zoom/pan state
@@ -74,8 +206,15 @@ def create_map_figure(df, selected_ids=None):
 
 
 def layout(**kwargs):
-    # Read data from database
-    df = read_geo_data_from_db()
+    # The table only needs the attributes, geometries are read for the areas in view
+    df = read_table('geo_data', columns=TABLE_COLUMNS)
+    mode = map_render_mode(count_geo_features())
+    if mode == 'tiles':
+        # Tiles load the areas in view on their own, without a cap
+        areas, geojson_data, status = df, None, ""
+    else:
+        areas, geojson_data = visible_areas(viewport_bounds())
+        status = map_status(len(areas))
     
     return html.Div([
         html.H1("Geospatial Data Viewer", style={'textAlign': 'center', 'margin': '20px'}),
@@ -91,18 +230,34 @@ def layout(**kwargs):
             html.H4("Map View"),
             dcc.Graph(
                 id='geo-map',
-                figure=create_map_figure(df),
+                figure=create_map_figure(areas, mode=mode, geojson_data=geojson_data),
                 config={
                     'scrollZoom': True,  # Enable scroll to zoom
                     'displayModeBar': False,  # Hide the toolbar
                     'doubleClick': 'reset'  # Double-click to reset view
                 }
-            )
+            ),
+            html.Div(id='map-status', children=status,
+                     style={'fontSize': '12px', 'color': '#666'}),
+            html.H4("Layers"),
+            html.Div(layer_controls()),
+            # Layers whose trace has been sent, the others are placeholders
+            dcc.Store(id='map-loaded-layers', data=[
+                layer_id for layer_id, layer in MAP_LAYERS.items() if layer['visible']
+            ]),
         ], style={'margin': '20px'}),
+
+        # Row index of each area id, so selections sync without the server
+        dcc.Store(id='geo-row-index', data={str(i): row for row, i in enumerate(df['id'].tolist())}),
+        # Table rows, sent column by column and expanded in the browser
+        dcc.Store(id='geo-table-columnar', data=to_columnar(df)),
+        # Selected ids whose geometry isn't in the browser yet
+        dcc.Store(id='geo-missing-selection'),
         
         # Table section
         html.Div([
             html.H4("Data Table"),
+            html.Div(export_links('geo_data'), style={'marginBottom': '10px'}),
             dash_table.DataTable(
                 id='geo-table',
                 columns=[
@@ -111,7 +266,7 @@ def layout(**kwargs):
                     {"name": "Population", "id": "population"},
                     {"name": "Area (km²)", "id": "area_km2"}
                 ],
-                data=df[['id', 'name', 'population', 'area_km2']].to_dict('records'),
+                data=[],
                 row_selectable='multi',
                 selected_rows=[],
                 page_size=10,
@@ -141,59 +296,159 @@ def layout(**kwargs):
     ])
 
 
-@callback(
+clientside_callback(
+    ClientsideFunction('columnar', 'to_records'),
+    Output('geo-table', 'data'),
+    Input('geo-table-columnar', 'data')
+)
+
+
+# Highlight the selected rows on the map in the browser, reusing the
+# geometry already held by the base and highlight traces
+clientside_callback(
+    """
+    function(selectedRows, tableData, figure) {
+        // Trace order matches BASE_TRACE and HIGHLIGHT_TRACE
+        const base = figure.data[0];
+        const highlight = figure.data[1];
+        const known = {};
+        [base, highlight].forEach(trace => {
+            ((trace.geojson || {}).features || []).forEach(f => {
+                known[f.properties.id] = f;
+            });
+        });
+
+        const rows = (selectedRows || []).map(i => tableData[i]);
+        const found = rows.filter(row => known[row.id]);
+        const missing = rows.filter(row => !known[row.id]);
+
+        const updated = Object.assign({}, highlight, {
+            geojson: {type: 'FeatureCollection', features: found.map(row => known[row.id])},
+            locations: found.map(row => row.id),
+            z: found.map(() => 1),
+            customdata: found.map(row => [row.name, row.population, row.area_km2])
+        });
+        const data = figure.data.slice();
+        data[1] = updated;
+        return [
+            Object.assign({}, figure, {data: data}),
+            missing.length ? rows.map(row => row.id) : window.dash_clientside.no_update
+        ];
+    }
+    """,
     Output('geo-map', 'figure'),
+    Output('geo-missing-selection', 'data'),
     Input('geo-table', 'selected_rows'),
+    State('geo-table', 'data'),
+    State('geo-map', 'figure'),
     prevent_initial_call=True
 )
-def update_map_from_table(selected_rows):
-    """Update map highlighting based on table selection"""
-    df = read_geo_data_from_db()
-    
-    if selected_rows:
-        selected_ids = [df.iloc[i]['id'] for i in selected_rows]
-    else:
-        selected_ids = None
-    
-    return create_map_figure(df, selected_ids)
 
 
 @callback(
+    Output('geo-map', 'figure', allow_duplicate=True),
+    Input('geo-missing-selection', 'data'),
+    prevent_initial_call=True
+)
+def load_selected_geometry(selected_ids):
+    """Fetch the selected areas the browser doesn't hold, e.g. outside the view or in tiles mode"""
+    # Only the highlight trace is sent, the base trace stays in the browser
+    patched_figure = Patch()
+    for key, value in highlight_trace_update(selected_ids).items():
+        patched_figure['data'][HIGHLIGHT_TRACE][key] = value
+    return patched_figure
+
+
+# Toggle the clicked area's row in the table selection, in the browser
+clientside_callback(
+    """
+    function(clickData, selectedRows, rowIndex) {
+        if (!clickData || !clickData.points || !clickData.points.length) {
+            return window.dash_clientside.no_update;
+        }
+        const row = rowIndex[String(clickData.points[0].location)];
+        if (row === undefined) {
+            return window.dash_clientside.no_update;
+        }
+        const selection = (selectedRows || []).slice();
+        const at = selection.indexOf(row);
+        if (at >= 0) {
+            selection.splice(at, 1);
+        } else {
+            selection.push(row);
+        }
+        return selection;
+    }
+    """,
     Output('geo-table', 'selected_rows'),
     Input('geo-map', 'clickData'),
-    Input('geo-table', 'selected_rows'),
+    State('geo-table', 'selected_rows'),
+    State('geo-row-index', 'data'),
     prevent_initial_call=True
 )
-def update_table_from_map(clickData, current_selection):
-    """Update table selection based on map clicks - toggle selection"""
-    # Check which input triggered the callback
-    if not callback_context.triggered:
-        return current_selection or []
-    
-    trigger = callback_context.triggered[0]['prop_id']
-    
-    # Only process if the map was clicked
-    if 'geo-map' in trigger and clickData and 'points' in clickData:
-        # Get the clicked polygon's location (which is the id)
-        clicked_id = clickData['points'][0]['location']
-        
-        # Convert to int
-        clicked_id = int(clicked_id)
-        
-        # Read data to find the row index
-        df = read_geo_data_from_db()
-        row_index = df[df['id'] == clicked_id].index[0]
-        
-        # Initialize selection if None
-        if current_selection is None:
-            current_selection = []
-        
-        # Toggle selection: remove if already selected, add if not
-        if row_index in current_selection:
-            current_selection.remove(row_index)
-        else:
-            current_selection.append(row_index)
-        
-        return current_selection
-    
-    return current_selection or []
\ No newline at end of file
+
+
+def _value_of(inputs, layer_id):
+    """Value of the pattern-matched input of a layer"""
+    return next(item.get('value') for item in inputs if item['id']['layer'] == layer_id)
+
+
+@callback(
+    Output('geo-map', 'figure', allow_duplicate=True),
+    Output('map-loaded-layers', 'data'),
+    Input({'type': 'layer-visible', 'layer': ALL}, 'value'),
+    Input({'type': 'layer-opacity', 'layer': ALL}, 'value'),
+    State('map-loaded-layers', 'data'),
+    prevent_initial_call=True
+)
+def update_layer(visible, opacity, loaded):
+    """Show, hide or restyle the layer whose control changed, patching only its trace"""
+    layer_id = ctx.triggered_id['layer']
+    index = layer_trace_index(layer_id)
+    shown = 'visible' in _value_of(ctx.inputs_list[0], layer_id)
+    layer_opacity = _value_of(ctx.inputs_list[1], layer_id)
+
+    patched_figure = Patch()
+    if layer_id not in loaded:
+        if not shown:
+            return no_update, no_update
+        # First time shown: the whole trace is sent once
+        trace = dict(get_layer_trace(layer_id))
+        trace['marker'] = dict(trace.get('marker', {}), opacity=layer_opacity)
+        patched_figure['data'][index] = trace
+        return patched_figure, loaded + [layer_id]
+
+    patched_figure['data'][index]['visible'] = shown
+    patched_figure['data'][index]['marker']['opacity'] = layer_opacity
+    return patched_figure, no_update
+
+
+def map_status(shown):
+    """Note shown under the map when the areas in view were capped"""
+    if shown < config.MAP_MAX_FEATURES or shown >= count_geo_features():
+        return ""
+    return f"Showing the {shown:,} largest areas in view. Zoom in to see more."
+
+
+@callback(
+    Output('geo-map', 'figure', allow_duplicate=True),
+    Output('map-status', 'children'),
+    Input('geo-map', 'relayoutData'),
+    prevent_initial_call=True
+)
+def update_map_viewport(relayout_data):
+    """Redraw the base trace with the areas in view after a pan or zoom"""
+    # Small tables are drawn whole, and tiles load per viewport on their own
+    total = count_geo_features()
+    if (
+        total <= config.MAP_MAX_FEATURES
+        or map_render_mode(total) == 'tiles'
+        or not any(key.startswith('map.') for key in (relayout_data or {}))
+    ):
+        return no_update, no_update
+
+    areas, geojson_data = visible_areas(viewport_bounds(relayout_data))
+    patched_figure = Patch()
+    for key, value in base_trace_update(areas, geojson_data).items():
+        patched_figure['data'][BASE_TRACE][key] = value
+    return patched_figure, map_status(len(areas))
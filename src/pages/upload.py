@@ -0,0 +1,88 @@
+from dash import html, dcc, register_page, Input, Output, State
+from src.ingest import UPLOAD_TABLES, ingest_upload
+from src.jobs import background_callback, run_deduplicated
+
+# Register this page with Dash
+register_page(__name__, path='/upload', name='Upload')
+
+# Styles of the ingestion progress controls while it runs and otherwise
+RUNNING = {'display': 'block', 'marginTop': '20px'}
+HIDDEN = {'display': 'none'}
+# Style of the file input while an upload is ingested, so no other file is chosen
+LOCKED = {'pointerEvents': 'none', 'opacity': 0.5}
+
+
+def throughput(done_bytes, rows, seconds):
+    """Ingestion speed as text"""
+    seconds = max(seconds, 0.001)
+    return f"{done_bytes / 2 ** 20 / seconds:,.1f} MiB/s, {rows / seconds:,.0f} rows/s"
+
+
+# Define the layout for this page
+def layout():
+    return html.Div([
+        html.H1("Upload Data", style={'textAlign': 'center', 'margin': '20px'}),
+        html.Hr(),
+
+        html.Div([
+            html.H4("Replace a Table"),
+            html.P("Upload a CSV or GeoJSON file to replace the rows of a table. Large files are sent in "
+                   "chunks; if the upload is interrupted, select the same file again to resume it.",
+                   style={'fontSize': '14px', 'color': '#666'}),
+            dcc.Dropdown(
+                id='upload-table',
+                options=[{'label': table, 'value': table} for table in UPLOAD_TABLES],
+                value=UPLOAD_TABLES[0],
+                clearable=False,
+                style={'width': '300px', 'marginBottom': '20px'}
+            ),
+            # assets/upload.js adds the file input here, sends the chosen file and
+            # sets upload-complete once it is on the server
+            html.Div(id='upload-file-container'),
+            html.Div([
+                html.Progress(id='upload-progress', value='0', max='1', style={'width': '300px', 'marginRight': '10px'}),
+                html.Span(id='upload-status', style={'fontSize': '14px', 'color': '#666'}),
+            ], style={'marginTop': '20px'}),
+            dcc.Store(id='upload-complete'),
+
+            # Shown while the upload is parsed and written to the database
+            html.Div([
+                html.Progress(id='ingest-progress', value='0', max='1', style={'width': '300px', 'marginRight': '10px'}),
+                html.Span(id='ingest-throughput', style={'fontSize': '14px', 'color': '#666', 'marginRight': '10px'}),
+                html.Button('Cancel', id='cancel-ingest-button', n_clicks=0),
+            ], id='ingest-running', style=HIDDEN),
+            html.Div(id='ingest-status', style={'marginTop': '20px', 'fontSize': '16px', 'fontWeight': 'bold'}),
+        ], style={'margin': '20px'})
+    ])
+
+
+@background_callback(
+    Output('ingest-status', 'children'),
+    Input('upload-complete', 'data'),
+    State('upload-table', 'value'),
+    running=[
+        (Output('ingest-running', 'style'), RUNNING, HIDDEN),
+        (Output('upload-file-container', 'style'), LOCKED, {}),
+    ],
+    progress=[Output('ingest-progress', 'value'), Output('ingest-progress', 'max'), Output('ingest-throughput', 'children')],
+    # Cancelling rolls the transaction back, the table keeps its rows
+    cancel=[Input('cancel-ingest-button', 'n_clicks')],
+    prevent_initial_call=True
+)
+def ingest(set_progress, upload, table_name):
+    """Replace the chosen table with the uploaded file's rows"""
+    def report(done, total, rows, seconds):
+        set_progress((str(done), str(total), throughput(done, rows, seconds)))
+
+    try:
+        # An upload completed twice, e.g. from two tabs, is ingested once
+        _, _, rows, seconds = run_deduplicated('ingest', (upload['upload_id'], table_name), lambda: ingest_upload(
+            upload['upload_id'], upload['filename'], table_name, progress=report
+        ))
+    except Exception as e:
+        return html.Span(f"✗ Error ingesting {upload['filename']}: {str(e)}", style={'color': '#e74c3c'})
+
+    return html.Span(
+        f"✓ Replaced {table_name} with {rows:,} rows in {seconds:.1f}s ({throughput(upload['size'], rows, seconds)})",
+        style={'color': '#27ae60'}
+    )
@@ -0,0 +1,115 @@
+# Compact encodings for callback payloads and compression of server responses
+#
+# Figures go out with their numeric arrays as base64 typed arrays, tables as
+# one list per column (expanded back to rows in the browser by
+# assets/columnar.js), and every large text response is gzip or brotli encoded.
+import gzip
+import hashlib
+import flask
+import pandas as pd
+import plotly.graph_objects as go
+from src import config
+from src.lib import DataCache
+
+try:
+    import brotli  # Optional dependency, gzip is used without it
+except ImportError:
+    brotli = None
+
+# Response types worth compressing; images and archives already are
+COMPRESSIBLE_MIMETYPES = [
+    'text/html', 'text/css', 'text/csv', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'application/vnd.mapbox-vector-tile',
+]
+
+# GET responses (bundles, assets, tiles) are compressed once per content,
+# callback responses every time
+_compressed_gets = DataCache(max_entries=256, max_bytes=64 * 1024 * 1024)
+
+
+def typed_array(values):
+    """Encode a numeric array as a plotly.js typed array spec, for figure updates sent through Patch
+
+    go.Figure does this for the arrays of a whole figure; dicts assigned to a
+    Patch are serialized as plain lists without it. The array is encoded
+    through a throwaway figure, plotly's public way to the same spec.
+    """
+    return go.Figure(go.Scatter(x=values)).to_plotly_json()['data'][0]['x']
+
+
+def to_columnar(df):
+    """Encode a DataFrame as {'columns', 'length', 'values'} with one list per column
+
+    Text columns with repeated values are sent once per distinct value, as
+    {'categories': [...], 'codes': [...]} with -1 for missing values.
+    """
+    values = {}
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == object or isinstance(series.dtype, pd.CategoricalDtype):
+            codes, categories = pd.factorize(series)
+            if len(categories) * 2 <= len(series):
+                values[col] = {'categories': categories.tolist(), 'codes': codes.tolist()}
+                continue
+        if series.hasnans:
+            # NaN isn't valid JSON, the table shows null cells as empty
+            series = series.astype(object).where(series.notna(), None)
+        values[col] = series.tolist()
+    return {'columns': [str(col) for col in df.columns], 'length': len(df), 'values': values}
+
+
+def compress(data, encoding):
+    """Compress response bytes with 'br' or 'gzip'"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=config.BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=config.GZIP_LEVEL)
+
+
+def accepted_encoding(accept_encodings):
+    """Best encoding the client accepts that is available here, or None"""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def register_compression(server):
+    """Compress large text responses of the Flask server for clients that accept it
+
+    Register it before other after_request handlers that look at response sizes,
+    Flask runs them in reverse order so those still see the uncompressed body.
+    """
+
+    @server.after_request
+    def compress_response(response):
+        if (
+            response.direct_passthrough or response.is_streamed
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+        encoding = accepted_encoding(flask.request.accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < config.COMPRESSION_MIN_BYTES:
+            return response
+
+        if flask.request.method == 'GET':
+            body = _compressed_gets.get_or_load(
+                f'{encoding}:{flask.request.path}', hashlib.sha256(data).hexdigest(),
+                lambda: compress(data, encoding)
+            )
+        else:
+            body = compress(data, encoding)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        etag, _ = response.get_etag()
+        if etag:
+            # The encoded body differs byte for byte from the one the tag names
+            response.set_etag(etag, weak=True)
+        return response
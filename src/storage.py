@@ -0,0 +1,187 @@
+# Storage backends the table readers in src/lib.py go through
+#
+# SQLite is the system of record: edits, paging and summaries run there. The
+# Parquet backend keeps a columnar snapshot of each table, exported from SQLite
+# whenever the table's revision moves, and queries it with DuckDB so that column
+# projection and filters are pushed down into the Parquet scan.
+import glob
+import json
+import os
+import threading
+import pandas as pd
+import shapely
+
+# Operators accepted in (column, operator, value) filters
+FILTER_OPERATORS = ['=', '!=', '<', '<=', '>', '>=', 'in']
+
+# Bounding box columns stored next to WKB geometries in Parquet snapshots,
+# so bounding box queries can skip row groups using the column statistics
+BBOX_COLUMNS = ['minx', 'miny', 'maxx', 'maxy']
+# Every column of a snapshot except the bounding box ones
+_TABLE_COLUMNS = f"COLUMNS(c -> c NOT IN ({', '.join(repr(col) for col in BBOX_COLUMNS)}))"
+
+
+def _column_list(columns):
+    return '*' if columns is None else ', '.join(f'"{col}"' for col in columns)
+
+
+def _filter_clauses(filters, in_clause):
+    """SQL conditions and parameters for (column, operator, value) filters"""
+    clauses, params = [], []
+    for column, operator, value in filters or []:
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Unsupported filter operator: {operator}")
+        if operator == 'in':
+            clause, value_params = in_clause(column, list(value))
+            clauses.append(clause)
+            params.extend(value_params)
+        else:
+            clauses.append(f'"{column}" {operator} ?')
+            params.append(value)
+    return clauses, params
+
+
+def _where(clauses):
+    return f" WHERE {' AND '.join(clauses)}" if clauses else ''
+
+
+class SQLiteStorage:
+    """Read tables straight from the SQLite database"""
+
+    name = 'sqlite'
+
+    def __init__(self, get_connection):
+        self._get_connection = get_connection
+
+    @staticmethod
+    def _in_clause(column, values):
+        # Bound as a single JSON array to avoid SQLite's limit on parameters
+        return f'"{column}" IN (SELECT value FROM json_each(?))', [json.dumps(values)]
+
+    def read(self, table_name, columns=None, filters=None):
+        """Read the given columns of the rows matching every filter"""
+        clauses, params = _filter_clauses(filters, self._in_clause)
+        query = f'SELECT {_column_list(columns)} FROM "{table_name}"{_where(clauses)}'
+        return pd.read_sql_query(query, self._get_connection(), params=params)
+
+    def read_chunks(self, table_name, chunk_rows):
+        """Read every row of a table as DataFrames of at most chunk_rows rows"""
+        return pd.read_sql_query(f'SELECT * FROM "{table_name}"', self._get_connection(), chunksize=chunk_rows)
+
+    def read_in_bbox(self, table_name, minx, miny, maxx, maxy, limit=None):
+        """Read the rows whose bounding box intersects the given one, largest first when limited"""
+        query = f"""
+            SELECT g.* FROM "{table_name}_rtree" r JOIN "{table_name}" g ON g.id = r.id
+            WHERE r.maxx >= ? AND r.minx <= ? AND r.maxy >= ? AND r.miny <= ?
+        """
+        params = [minx, maxx, miny, maxy]
+        if limit is not None:
+            query += " ORDER BY (r.maxx - r.minx) * (r.maxy - r.miny) DESC LIMIT ?"
+            params.append(limit)
+        return pd.read_sql_query(query, self._get_connection(), params=params)
+
+
+class ParquetStorage:
+    """Read tables from Parquet snapshots of the SQLite tables, queried with DuckDB"""
+
+    name = 'parquet'
+
+    def __init__(self, directory, source, get_revision):
+        import duckdb  # Optional dependency, only needed for this backend
+
+        self.directory = directory
+        self._source = source
+        self._get_revision = get_revision
+        self._duckdb = duckdb.connect()
+        self._export_lock = threading.Lock()
+
+    @staticmethod
+    def _in_clause(column, values):
+        # DuckDB has no parameter limit, and a literal IN list is pushed into the scan
+        if not values:
+            return 'FALSE', []
+        return f'"{column}" IN ({", ".join("?" for _ in values)})', values
+
+    def snapshot_path(self, table_name):
+        """Path of the table's snapshot for its current revision, exporting it if needed"""
+        revision = self._get_revision(table_name)
+        path = os.path.join(self.directory, f'{table_name}-{revision}.parquet')
+        if not os.path.exists(path):
+            with self._export_lock:
+                if not os.path.exists(path):
+                    self._export(table_name, revision, path)
+        return path
+
+    def _export(self, table_name, revision, path):
+        df = self._source.read(table_name)
+        if 'geometry' in df.columns:
+            bounds = shapely.bounds(shapely.from_wkb(df['geometry']))
+            for i, col in enumerate(BBOX_COLUMNS):
+                df[col] = bounds[:, i]
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename so other workers never read a partial file
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        cursor = self._duckdb.cursor()
+        cursor.register('snapshot', df)
+        cursor.execute(f"COPY snapshot TO '{tmp_path}' (FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE 100000)")
+        cursor.close()
+        os.replace(tmp_path, path)
+
+        # Keep the previous revision, which other workers may still be reading
+        for old_path in glob.glob(os.path.join(self.directory, f'{table_name}-*.parquet')):
+            old_revision = os.path.basename(old_path)[len(table_name) + 1:-len('.parquet')]
+            if old_revision.isdigit() and int(old_revision) < revision - 1:
+                os.remove(old_path)
+
+    @staticmethod
+    def _decode_blobs(df):
+        # BLOBs come back as bytearray, which shapely's WKB reader rejects
+        for col in df.columns[df.dtypes == object]:
+            if len(df) and isinstance(df[col].iloc[0], bytearray):
+                df[col] = [bytes(value) if value is not None else None for value in df[col]]
+        return df
+
+    def _query(self, query, params):
+        cursor = self._duckdb.cursor()
+        try:
+            df = cursor.execute(query, params).df()
+        finally:
+            cursor.close()
+        return self._decode_blobs(df)
+
+    def read(self, table_name, columns=None, filters=None):
+        """Read the given columns of the rows matching every filter"""
+        clauses, params = _filter_clauses(filters, self._in_clause)
+        columns_sql = _TABLE_COLUMNS if columns is None else _column_list(columns)
+        path = self.snapshot_path(table_name).replace("'", "''")
+        return self._query(f"SELECT {columns_sql} FROM read_parquet('{path}'){_where(clauses)}", params)
+
+    def read_in_bbox(self, table_name, minx, miny, maxx, maxy, limit=None):
+        """Read the rows whose bounding box intersects the given one, largest first when limited"""
+        path = self.snapshot_path(table_name).replace("'", "''")
+        query = f"""
+            SELECT {_TABLE_COLUMNS} FROM read_parquet('{path}')
+            WHERE maxx >= ? AND minx <= ? AND maxy >= ? AND miny <= ?
+        """
+        params = [minx, maxx, miny, maxy]
+        if limit is not None:
+            query += " ORDER BY (maxx - minx) * (maxy - miny) DESC LIMIT ?"
+            params.append(limit)
+        return self._query(query, params)
+
+    def read_chunks(self, table_name, chunk_rows):
+        """Read every row of a table as DataFrames of about chunk_rows rows"""
+        path = self.snapshot_path(table_name).replace("'", "''")
+        cursor = self._duckdb.cursor()
+        try:
+            cursor.execute(f"SELECT {_TABLE_COLUMNS} FROM read_parquet('{path}')")
+            # DuckDB hands out rows in vectors of 2048
+            vectors = max(1, chunk_rows // 2048)
+            while True:
+                df = cursor.fetch_df_chunk(vectors)
+                if len(df) == 0:
+                    break
+                yield self._decode_blobs(df)
+        finally:
+            cursor.close()
@@ -0,0 +1,248 @@
+# Mapbox Vector Tiles (MVT) for the geo_data table
+import hashlib
+import math
+import os
+import struct
+import flask
+import numpy as np
+import shapely
+from dash import get_relative_path
+from src import config
+from src.lib import DataCache, data_cache, get_data_version, read_geo_data_from_db
+from src.metrics import instrument
+
+# Name of the layer inside each tile, referenced by map layers as 'sourcelayer'
+TILE_LAYER = 'geo_data'
+# Attributes copied into each tile feature
+TILE_PROPERTIES = ['id', 'name']
+
+# Half the width of the Web Mercator world, in meters
+MERCATOR_HALF_WORLD = 20037508.342789244
+
+tile_cache = DataCache(max_entries=config.TILE_CACHE_MAX_ENTRIES, max_bytes=config.TILE_CACHE_MAX_BYTES)
+
+
+def get_tile_source():
+    """Get geo_data projected to Web Mercator with a spatial index, built once per data version"""
+    return data_cache.get_or_load('tile_source', get_data_version(), _build_tile_source, sizeof=_tile_source_size)
+
+
+def _build_tile_source():
+    gdf = read_geo_data_from_db()
+    geometries = gdf.geometry.to_crs(epsg=3857).values
+
+    # Content hash, so tile URLs and the disk cache are stable across workers
+    digest = hashlib.sha1()
+    for wkb in shapely.to_wkb(geometries):
+        digest.update(wkb)
+    digest.update(gdf[TILE_PROPERTIES].to_json().encode())
+
+    return {
+        'geometries': geometries,
+        'tree': shapely.STRtree(geometries),
+        'properties': {col: gdf[col].tolist() for col in TILE_PROPERTIES},
+        'hash': digest.hexdigest()[:16],
+        'num_coordinates': int(shapely.get_num_coordinates(geometries).sum()),
+    }
+
+
+def _tile_source_size(source):
+    return source['num_coordinates'] * 16 + len(source['geometries']) * 200
+
+
+def tile_bounds(z, x, y):
+    """Web Mercator bounds (minx, miny, maxx, maxy) of a tile"""
+    size = 2 * MERCATOR_HALF_WORLD / 2 ** z
+    minx = -MERCATOR_HALF_WORLD + x * size
+    maxy = MERCATOR_HALF_WORLD - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+@instrument
+def get_tile(z, x, y):
+    """Get an encoded tile, from the memory or disk cache when possible"""
+    source = get_tile_source()
+    path = None
+    if config.TILE_CACHE_DIR:
+        path = os.path.join(config.TILE_CACHE_DIR, source['hash'], str(z), str(x), f'{y}.pbf')
+    return tile_cache.get_or_load(
+        f'{z}/{x}/{y}', source['hash'], lambda: _load_tile(source, z, x, y, path), sizeof=len
+    )
+
+
+def _load_tile(source, z, x, y, path):
+    if path and os.path.exists(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    tile = render_tile(source, z, x, y)
+    if path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so other workers never read a partial tile
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(tile)
+        os.replace(tmp_path, path)
+    return tile
+
+
+def render_tile(source, z, x, y):
+    """Clip, simplify and quantize the features intersecting a tile and encode them as MVT"""
+    extent = config.TILE_EXTENT
+    minx, miny, maxx, maxy = tile_bounds(z, x, y)
+    unit = (maxx - minx) / extent
+    buffer = config.TILE_BUFFER * unit
+
+    candidates = source['tree'].query(
+        shapely.box(minx - buffer, miny - buffer, maxx + buffer, maxy + buffer)
+    )
+    candidates.sort()
+    geometries = source['geometries'][candidates]
+
+    # Detail below one tile unit is invisible at this zoom
+    geometries = shapely.simplify(geometries, unit * config.TILE_SIMPLIFY_UNITS, preserve_topology=True)
+    geometries = shapely.clip_by_rect(geometries, minx - buffer, miny - buffer, maxx + buffer, maxy + buffer)
+
+    # Tile coordinates have their origin top-left with y pointing down
+    geometries = shapely.transform(
+        geometries, lambda coords: np.column_stack([(coords[:, 0] - minx) / unit, (maxy - coords[:, 1]) / unit])
+    )
+    geometries = shapely.set_precision(geometries, grid_size=1)
+    # MVT exterior rings have a positive area in tile coordinates
+    geometries = shapely.orient_polygons(geometries, exterior_cw=False)
+
+    keep = ~shapely.is_empty(geometries)
+    features = [
+        (int(source['properties']['id'][i]), {col: source['properties'][col][i] for col in TILE_PROPERTIES}, geometry)
+        for i, geometry in zip(candidates[keep], geometries[keep])
+    ]
+    return encode_tile(TILE_LAYER, features, extent)
+
+
+# --- Minimal protobuf writer for the MVT schema (vector_tile.proto v2) ---
+
+def _varint(value):
+    # Negative values never shift down to 0; signed fields go through _zigzag
+    if value < 0:
+        raise ValueError(f"Varints are unsigned, got {value}")
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _bytes_field(number, payload):
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _packed_field(number, values):
+    return _bytes_field(number, b''.join(_varint(v) for v in values))
+
+
+def _encode_value(value):
+    if isinstance(value, (bool, np.bool_)):
+        return _field(7, 0) + _varint(int(value))
+    if isinstance(value, (int, np.integer)):
+        return _field(6, 0) + _varint(_zigzag(int(value)))
+    if isinstance(value, (float, np.floating)):
+        return _field(3, 1) + struct.pack('<d', float(value))
+    return _bytes_field(1, str(value).encode())
+
+
+def _encode_ring(coords, commands):
+    # The closing point is implied by ClosePath
+    coords = coords[:-1]
+    if len(coords) < 3:
+        return
+    previous = commands['cursor']
+    deltas = np.diff(np.vstack([previous, coords]), axis=0).astype(np.int64)
+    commands['out'].append((1 & 0x7) | (1 << 3))  # MoveTo
+    commands['out'].extend(_zigzag(int(d)) for d in deltas[0])
+    commands['out'].append((2 & 0x7) | ((len(deltas) - 1) << 3))  # LineTo
+    commands['out'].extend(_zigzag(int(d)) for d in deltas[1:].ravel())
+    commands['out'].append((7 & 0x7) | (1 << 3))  # ClosePath
+    commands['cursor'] = coords[-1]
+
+
+def _encode_geometry(geometry):
+    """Encode a (multi)polygon as an MVT command stream"""
+    commands = {'out': [], 'cursor': np.zeros(2)}
+    for polygon in getattr(geometry, 'geoms', [geometry]):
+        if polygon.geom_type != 'Polygon':
+            continue
+        _encode_ring(np.asarray(polygon.exterior.coords), commands)
+        for interior in polygon.interiors:
+            _encode_ring(np.asarray(interior.coords), commands)
+    return commands['out']
+
+
+def encode_tile(layer_name, features, extent):
+    """Encode (id, properties, geometry) features as a single-layer MVT tile"""
+    keys, values = {}, {}
+    encoded_features = []
+    for feature_id, properties, geometry in features:
+        geometry_commands = _encode_geometry(geometry)
+        if not geometry_commands:
+            continue
+        tags = []
+        for key, value in properties.items():
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value).__name__, value), len(values)))
+        # Feature ids are uint64 in the MVT schema, other ids are left out
+        id_field = _field(1, 0) + _varint(feature_id) if 0 <= feature_id < 2 ** 64 else b''
+        encoded_features.append(
+            id_field
+            + _packed_field(2, tags)
+            + _field(3, 0) + _varint(3)  # POLYGON
+            + _packed_field(4, geometry_commands)
+        )
+
+    layer = (
+        _field(15, 0) + _varint(2)
+        + _bytes_field(1, layer_name.encode())
+        + b''.join(_bytes_field(2, f) for f in encoded_features)
+        + b''.join(_bytes_field(3, k.encode()) for k in keys)
+        + b''.join(_bytes_field(4, _encode_value(v)) for _, v in values)
+        + _field(5, 0) + _varint(extent)
+    )
+    return _bytes_field(3, layer)
+
+
+def tile_url_template():
+    """Absolute URL template of the geo_data tiles, for use as a map layer source"""
+    # MapLibre fetches tiles from a web worker, which can't resolve relative URLs
+    path = get_relative_path(f"/tiles/{TILE_LAYER}/{get_tile_source()['hash']}/") + '{z}/{x}/{y}.pbf'
+    if flask.has_request_context():
+        return flask.request.host_url.rstrip('/') + path
+    return path
+
+
+def register_tile_routes(server):
+    """Serve geo_data tiles from the Flask server"""
+
+    @server.route(f'/tiles/{TILE_LAYER}/<version>/<int:z>/<int:x>/<int:y>.pbf')
+    def geo_data_tile(version, z, x, y):
+        if not (0 <= z <= config.TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            flask.abort(404)
+        response = flask.Response(get_tile(z, x, y), mimetype='application/vnd.mapbox-vector-tile')
+        # URLs carry the data hash, so a tile for the current data never changes
+        if version == get_tile_source()['hash']:
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
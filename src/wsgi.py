@@ -0,0 +1,52 @@
+# Production entry point: gunicorn "src.wsgi:server"
+#
+# Seeds only missing tables, then warms the data caches and page layouts so the
+# first requests don't pay for them. With gunicorn --preload this runs once in
+# the master and the workers inherit the warm caches.
+import time
+
+_started = time.perf_counter()
+
+import dash
+from src import config
+from src.lib import ensure_geo_index, seed_missing_tables
+from src.main import create_app
+
+# Seconds spent in each startup phase, in order
+startup_timings = {'imports': time.perf_counter() - _started}
+
+
+def _phase(name, func):
+    start = time.perf_counter()
+    result = func()
+    startup_timings[name] = time.perf_counter() - start
+    return result
+
+
+def warm_page_layouts(app):
+    """Render every page layout once, loading the data caches they use (and the tile source in tiles mode)"""
+    # Layouts may build absolute URLs, so they need a request to look at
+    with app.server.test_request_context():
+        for page in dash.page_registry.values():
+            if callable(page['layout']):
+                page['layout']()
+
+
+def warm_data():
+    """Check the spatial index, rebuilding it if the table changed outside the app"""
+    ensure_geo_index()
+
+
+_phase('seed', seed_missing_tables)
+app = _phase('create_app', create_app)
+_phase('warm_data', warm_data)
+_phase('warm_layouts', lambda: warm_page_layouts(app))
+
+# WSGI application for gunicorn and other servers
+server = app.server
+
+print(
+    f"Startup took {time.perf_counter() - _started:.2f}s ("
+    + ', '.join(f"{name} {seconds:.2f}s" for name, seconds in startup_timings.items())
+    + f") using {config.DB_PATH}"
+)